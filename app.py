@@ -1,15 +1,38 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
+import sys
+import time
+from functools import lru_cache, partial, wraps
+
 from dash import Dash
-from dash import html, dcc
+from dash import html, dcc, Patch
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
-import plotly.express as px
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import pandas as pd
-import plotly.graph_objects as go
+import plotly.express as px
 from plotly.subplots import make_subplots
 
+import background
+import data_cache
+import figure_dicts
+import lod
+import payload
+import rank_tables
+import render_policy
+from choropleth import DiscreteChoropleth
+from datasets import DataVersions
+from figure_cache import FigureBank, FigureCache, Lazy, Live, build_times
+from http_cache import CachedLayout, CallbackETags, immutable_assets
+from metrics import CallbackMetrics
+from payload import compact_figure, compact_trace, compacted
+from profiler import RequestProfiler
+from ranks import RankMatrix, rank_column
+
+import_started = time.perf_counter()
+
 app = Dash(__name__, external_stylesheets=[dbc.themes.LUX],
                  meta_tags=[
                      {'name':'viewport', 'content':'width=device_width, initial-scale=1.0'}
@@ -17,9 +40,82 @@ app = Dash(__name__, external_stylesheets=[dbc.themes.LUX],
 server=app.server
 
 app.title = 'AV Portfolio'
-top_df = pd.read_csv('top_top.csv')
-gen_df = pd.read_csv('gen_max.csv')
-fam_df = pd.read_csv('fam_max.csv')
+# 'eager' builds the page figures at import, 'lazy' on first use or on /warmup
+figure_mode = os.environ.get('FIGURE_MODE', 'eager')
+# 'server' answers the callbacks in Python, 'static' in the browser from the
+# prerendered figures written by static_export.py, 'background' like 'server'
+# but runs the expensive figure callbacks as background jobs (background.py)
+callback_mode = os.environ.get('CALLBACK_MODE', 'server')
+# 'lazy' sends the page's graphs empty and draws each once it scrolls into view
+# (assets/lazy_graphs.js); the static site always embeds its figures
+graph_loading = 'eager' if callback_mode == 'static' else os.environ.get('GRAPH_LOADING', 'eager')
+# SHARES_FILE: per-country type shares (rank_tables.py); when set, the countries'
+# MAX_*/MIN_* columns are ranked from it instead of read from top_top.csv
+shares_file = os.environ.get('SHARES_FILE')
+country_files = ['top_top.csv'] + ([shares_file] if shares_file else [])
+data_files = country_files + ['gen_max.csv', 'fam_max.csv']
+
+def load_table(path):
+    # The shares come back ranked, through the data cache like the CSVs
+    if path == shares_file:
+        return rank_tables.read_ranks(path)
+    return data_cache.read_csv(path)
+
+# Tables, rank matrices and figure caches all belong to a data snapshot, see
+# datasets.py; callbacks take versions.current once and use only that
+versions = DataVersions(data_files, load=load_table)
+# Background variants built by images.py
+immutable_assets(app, 'img')
+# /metrics; set METRICS_DIR to add up the counts of several gunicorn workers
+callback_metrics = CallbackMetrics(server, os.environ.get('METRICS_DIR'))
+# PAYLOAD_SAMPLE=N measures the bytes compaction saves on one in N figures
+payload.listeners.append(callback_metrics.figure_bytes)
+
+if callback_mode == 'background':
+    background_dir = os.environ.get('BACKGROUND_CACHE_DIR', '.background_cache')
+    # Finished figures are shared by all workers until the data changes
+    figure_jobs = background.manager(background_dir, cache_by=[lambda: versions.current.version],
+                                     expire=int(os.environ.get('BACKGROUND_CACHE_EXPIRE', 3600)))
+    # At most BACKGROUND_WORKERS jobs build at once across all workers
+    worker_slots = background.WorkerSlots(os.path.join(background_dir, 'slots'),
+                                          int(os.environ.get('BACKGROUND_WORKERS', os.cpu_count())))
+
+def visible_store(graph):
+    # Set to true by assets/lazy_graphs.js once a lazy graph is in view
+    return '{}_visible'.format(graph)
+
+def graph_callback(graph, *dependencies, **kwargs):
+    # A server callback drawing graph; lazy graphs run it when the graph comes
+    # into view instead of on page load, with the visibility input first
+    if graph_loading == 'lazy':
+        # Right after the outputs, as Dash wants them first
+        i = next((i for i, dependency in enumerate(dependencies) if not isinstance(dependency, Output)), len(dependencies))
+        visible = Input(component_id=visible_store(graph), component_property='data')
+        dependencies = dependencies[:i] + (visible,) + dependencies[i:]
+        kwargs['prevent_initial_call'] = True
+    return app.callback(*dependencies, **kwargs)
+
+def graph_function(fn):
+    # fn as registered through graph_callback
+    if graph_loading != 'lazy':
+        return fn
+    @wraps(fn)
+    def when_visible(visible, *args):
+        return fn(*args)
+    return when_visible
+
+def figure_callback(graph, *dependencies):
+    # An expensive figure callback; in background mode a job that reports
+    # its progress in the graph's status line
+    if callback_mode != 'background':
+        register = graph_callback(graph, *dependencies)
+        return lambda fn: register(callback_metrics.timed(graph_function(fn)))
+    status = '{}_status'.format(graph)
+    register = graph_callback(graph, *dependencies, background=True, manager=figure_jobs,
+                              progress=Output(component_id=status, component_property='children'),
+                              running=[(Output(component_id=status, component_property='style'),
+                                        {'display': 'block'}, {'display': 'none'})])
+    return lambda fn: register(worker_slots.job(graph_function(fn)))
 
 colors_dict = {
     'INFJ' : '#52BE80', 'INFP' : '#1E8449', 'ENFJ' : '#58D68D', 'ENFP' : '#239B56',
@@ -28,77 +124,66 @@ colors_dict = {
     'ISTP' : '#F4D03F', 'ISFP' : '#B7950B', 'ESTP' : '#EB984E', 'ESFP' : '#AF601A',
 }
 
-fig_3D = px.scatter_3d(
-    top_df, x="GDP_per_capita_$", y="Life_expectancy", z = 'Unemployment_rate',
-    size="Population", color="Genus",
-    height=800,
-    hover_name="Country", log_x=True, log_z=True, size_max=60
-)
-fig_3D.update_layout(
-    margin={"r":0,"t":0,"l":0,"b":0},
-    legend=dict(yanchor="top", y=0, xanchor="left", x=0.01, orientation='h'),
-    title=dict(yanchor="top", y=1, xanchor="left", x=0),
-    paper_bgcolor='rgba(0,0,0,0)',
-    legend_font_color='rgba(235,237,239,1)',
-    scene=dict(
-        xaxis=dict(color='rgba(235,237,239,1)'),
-        yaxis=dict(color='rgba(235,237,239,1)'),
-        zaxis=dict(color='rgba(235,237,239,1)')
-              )
-)
-
-gen_options = []
-for x in list(gen_df.columns)[0:36]:
-    gen_options.append({'label':x, 'value':x})
-fam_options = []
-for x in list(fam_df.columns)[0:18]:
-    fam_options.append({'label':x, 'value':x})
-    
-@app.callback(
-    Output(component_id='gen_go_bubble', component_property='figure'),
-    Input(component_id='gen_go_dropdown', component_property='value')
-)
+def fig_3D_bins(top_df):
+    # Too many rows to send one by one; turning the 3D view gives no data
+    # window to refine, so this stays binned
+    columns = ["GDP_per_capita_$", "Life_expectancy", 'Unemployment_rate']
+    points = lod.plot_space([top_df[column] for column in columns], [True, False, True])
+    lo, hi = lod.extent(points)
+    bins = lod.aggregate(points, top_df['Population'], top_df['Genus'], lo, hi, lod.LOD_BINS_3D)
+    return pd.DataFrame({
+        columns[0]: 10 ** bins[0], columns[1]: bins[1], columns[2]: 10 ** bins[2],
+        'Population': bins['weight'], 'Genus': bins['label'], 'Country': lod.names(bins['count']),
+    })
 
-def update_gen(value):
-    fig = make_subplots()
-    for abc in value:
-        trace = go.Scatter(
-            x=gen_df.index,
-            y=gen_df[abc],
-            marker_size=gen_df['{}_T'.format(abc)],
-            name=abc,
-        )
-        fig.add_trace(trace)
+def fig_3D_figure(data):
+    top_df = data.top_df
+    lod_args = {}
+    if len(top_df) > lod.LOD_THRESHOLD:
+        lod_args = {'color_discrete_map': lod.color_map(top_df['Genus'])}
+        top_df = fig_3D_bins(top_df)
+    else:
+        # px groups by the color column without passing observed=, which for
+        # the cached categorical column is pandas' deprecated default; as plain
+        # labels only the genera present are grouped, as observed=True does
+        top_df = top_df.assign(Genus=top_df['Genus'].astype(object))
+    fig = px.scatter_3d(
+        top_df, x="GDP_per_capita_$", y="Life_expectancy", z = 'Unemployment_rate',
+        size="Population", color="Genus",
+        height=800,
+        hover_name="Country", log_x=True, log_z=True, size_max=60, **lod_args
+    )
     fig.update_layout(
         margin={"r":0,"t":0,"l":0,"b":0},
-        legend=dict(yanchor="top", y=-0.1, xanchor="left", x=0.01, orientation='h'),
+        legend=dict(yanchor="top", y=0, xanchor="left", x=0.01, orientation='h'),
         title=dict(yanchor="top", y=1, xanchor="left", x=0),
         paper_bgcolor='rgba(0,0,0,0)',
         legend_font_color='rgba(235,237,239,1)',
-        xaxis_color='rgba(235,237,239,1)',
-        yaxis_color='rgba(235,237,239,1)',
+        scene=dict(
+            xaxis=dict(color='rgba(235,237,239,1)'),
+            yaxis=dict(color='rgba(235,237,239,1)'),
+            zaxis=dict(color='rgba(235,237,239,1)')
+                  )
     )
     return fig
 
-@app.callback(
-    Output(component_id='fam_go_bubble', component_property='figure'),
-    Input(component_id='fam_go_dropdown', component_property='value')
-)
-def update_gen(value):
-    # Plotly express
+def go_bubble_trace(df, ranks, column, mode='svg'):
+    return figure_dicts.trace(
+        render_policy.scatter_type(mode),
+        x=df.index,
+        y=ranks.order(column),
+        marker=dict(size=df['{}_T'.format(column)]),
+        name=column,
+    )
+
+# Figures of the callbacks are plain dicts on layouts built once (figure_dicts.py)
+@figure_dicts.LayoutTemplate
+def go_bubble_layout():
     fig = make_subplots()
-    for abc in value:
-        trace = go.Scatter(
-            x=fam_df.index,
-            y=fam_df[abc],
-            marker_size=fam_df['{}_T'.format(abc)],
-            name=abc,
-        )
-        fig.add_trace(trace)
     fig.update_layout(
         margin={"r":0,"t":0,"l":0,"b":0},
         legend=dict(yanchor="top", y=-0.1, xanchor="left", x=0.01, orientation='h'),
-        title=dict(yanchor="top", y=1, xanchor="left", x=0),        
+        title=dict(yanchor="top", y=1, xanchor="left", x=0),
         paper_bgcolor='rgba(0,0,0,0)',
         legend_font_color='rgba(235,237,239,1)',
         xaxis_color='rgba(235,237,239,1)',
@@ -106,17 +191,67 @@ def update_gen(value):
     )
     return fig
 
-max_figs = []
-for i in range(2):
-    fig = px.choropleth(
-        locations = top_df['CODE'],
-        color = top_df['MAX_{}'.format(i)],
-        color_discrete_map = colors_dict,
-        hover_name = top_df['Country'],
-        hover_data = [top_df['Languages'], top_df['Genus'], top_df['Family']],
-        labels={'locations':'Alpha-3 code', 'color':'Type', 
-                'hover_data_0':'Language', 'hover_data_1':'Genus', 'hover_data_2':'Family'}
+def go_bubble_figure(df, ranks, value):
+    mode = render_policy.render_mode(len(df) * len(value))
+    return go_bubble_layout.figure([go_bubble_trace(df, ranks, abc, mode) for abc in value])
+
+def go_bubble_update(name, version, df, ranks, labels, value, shown):
+    # shown holds the data version and the traces already on the client; only
+    # the difference is sent, unless the data or the render mode changed since.
+    # A page loaded before a reload may still ask for labels the data dropped
+    value = [abc for abc in value or [] if abc in labels]
+    mode = render_policy.render_mode(len(df) * len(value))
+    if (shown is None or shown.get('version') != version or not set(shown['traces']) <= set(labels)
+            or render_policy.render_mode(len(df) * len(shown['traces'])) != mode):
+        return compact_figure(go_bubble_figure(df, ranks, value), name), {'version': version, 'traces': value}
+    shown = shown['traces']
+    patch = Patch()
+    for i in reversed(range(len(shown))):
+        if shown[i] not in value:
+            del patch['data'][i]
+    kept = [abc for abc in shown if abc in value]
+    for abc in value:
+        if abc not in kept:
+            patch['data'].append(compact_trace(go_bubble_trace(df, ranks, abc, mode)))
+            kept.append(abc)
+    return patch, {'version': version, 'traces': kept}
+
+def update_gen(value, shown):
+    data = versions.current
+    return go_bubble_update('gen_go_bubble', data.version, data.gen_df, data.gen_ranks, data.gen_labels, value, shown)
+
+def update_fam(value, shown):
+    data = versions.current
+    return go_bubble_update('fam_go_bubble', data.version, data.fam_df, data.fam_ranks, data.fam_labels, value, shown)
+
+for dropdown, update, function_name in (('gen_go', update_gen, 'genus'), ('fam_go', update_fam, 'family')):
+    if callback_mode == 'static':
+        app.clientside_callback(
+            ClientsideFunction(namespace='static_figures', function_name=function_name),
+            Output(component_id='{}_bubble'.format(dropdown), component_property='figure'),
+            Input(component_id='{}_dropdown'.format(dropdown), component_property='value'))
+    else:
+        figure_callback('{}_bubble'.format(dropdown),
+            Output(component_id='{}_bubble'.format(dropdown), component_property='figure'),
+            Output(component_id='{}_shown'.format(dropdown), component_property='data'),
+            Input(component_id='{}_dropdown'.format(dropdown), component_property='value'),
+            State(component_id='{}_shown'.format(dropdown), component_property='data'))(update)
+
+# One trace per map, colored through a stepped colorscale built from colors_dict
+type_map = DiscreteChoropleth(colors_dict)
+
+def type_map_traces(data, rank):
+    top_df = data.top_df
+    return type_map.traces(
+        top_df['CODE'], data.country_ranks.ranks[:, rank],
+        hovertext=top_df['Country'],
+        customdata=top_df[['Languages', 'Genus', 'Family']].to_numpy(dtype=object),
+        hover_labels=('Language', 'Genus', 'Family'),
     )
+
+@figure_dicts.LayoutTemplate
+def max_fig_layout():
+    fig = type_map.base_figure()
     fig.update_layout(
         margin={"r":0,"t":0,"l":0,"b":0},
         legend=dict(yanchor="top", y=0.6, xanchor="left", x=0.01),
@@ -125,33 +260,15 @@ for i in range(2):
         plot_bgcolor='rgba(0,0,0,0)',
         height=300,
     )
-    max_figs.append(fig)
+    return fig
+
+def max_fig_figure(data, i):
+    return max_fig_layout.figure(type_map_traces(data, i))
 
     
-@app.callback(
-    Output(component_id='slider-map-container', component_property='figure'),
-    Input(component_id='my-slider', component_property='value'))
-def update_output(value):    
-    if value<8:
-        fig = px.choropleth(
-            locations = top_df['CODE'],
-            color = top_df['MAX_{}'.format(value)],
-            color_discrete_map = colors_dict,
-            hover_name = top_df['Country'],
-            hover_data = [top_df['Languages'], top_df['Genus'], top_df['Family']],
-            labels={'locations':'Alpha-3 code', 'color':'Type', 
-                    'hover_data_0':'Language', 'hover_data_1':'Genus', 'hover_data_2':'Family'}
-        )
-    else:
-        fig = px.choropleth(
-            locations = top_df['CODE'],            
-            color = top_df['MIN_{}'.format(15-value)],
-            color_discrete_map = colors_dict,
-            hover_name = top_df['Country'],
-            hover_data = [top_df['Languages'], top_df['Genus'], top_df['Family']],
-            labels={'locations':'Alpha-3 code', 'color':'Type', 
-                    'hover_data_0':'Language', 'hover_data_1':'Genus', 'hover_data_2':'Family'}
-        )
+@figure_dicts.LayoutTemplate
+def slider_map_layout():
+    fig = type_map.base_figure()
     fig.update_layout(
         margin={"r":0,"t":0,"l":0,"b":0},
         legend=dict(yanchor="top", y=-0.05, xanchor="left", x=0.01, orientation='h'),
@@ -161,51 +278,66 @@ def update_output(value):
     )
     return fig
 
-@app.callback(
-     Output(component_id='my_bubble_chart', component_property='figure'),
-    [Input(component_id='slct_chart_1', component_property='value'),
-     Input(component_id='slct_chart_2', component_property='value'),
-     Input(component_id='slct_chart_3', component_property='value')]
-)
-def update_graph(option_slctd_1, option_slctd_2, option_slctd_3):
-    color_map={16:'Genus', 17:'Family', 18:'Region'}
-    
-    if option_slctd_3 < 8:
-        fig = px.scatter(
-            data_frame = top_df,
-            x=option_slctd_1, 
-            y=option_slctd_2,
-            size="Population",
-            color='MAX_{}'.format(option_slctd_3),
-            color_discrete_map = colors_dict,
-            hover_name="Country",
-            log_x=True,
-            size_max=60
-        )
-    elif option_slctd_3 > 15:
-        fig = px.scatter(
-            data_frame = top_df,
-            x=option_slctd_1, 
-            y=option_slctd_2,
-            size="Population",
-            color=color_map[option_slctd_3],
-            hover_name="Country",
-            log_x=True,
-            size_max=60
-        )
-    else:
-        fig = px.scatter(
-            data_frame = top_df,
-            x=option_slctd_1, 
-            y=option_slctd_2,
-            size="Population",
-            color='MIN_{}'.format(15-option_slctd_3),
-            color_discrete_map = colors_dict,
-            hover_name="Country",
-            log_x=True,
-            size_max=60
-        )
-        
+def slider_map_figure(data, value):
+    # Slider positions are ranks: 0 is the most common type, 15 the least common
+    return slider_map_layout.figure(type_map_traces(data, value))
+
+def update_output(value):
+    return versions.current.slider_map_bank[value]
+
+# 'client' ships the rank columns once and recolors the map in the browser
+# (assets/slider_map.js); 'server' answers every slider tick from the bank
+slider_map_mode = 'client' if callback_mode == 'static' else os.environ.get('SLIDER_MAP_MODE', 'client')
+
+def slider_map_data(data):
+    # The map trace and a legend entry as the server sends them, minus what
+    # changes with the slider
+    country_ranks = data.country_ranks
+    figure = data.slider_map_bank[0]
+    trace, legend_trace = figure['data'][0], figure['data'][1]
+    return {
+        'types': country_ranks.types,
+        'colors': [colors_dict[t] for t in country_ranks.types],
+        'ranks': country_ranks.ranks.T.tolist(),
+        'trace': {k: v for k, v in trace.items() if k not in ('z', 'text')},
+        'legend_trace': {k: v for k, v in legend_trace.items() if k not in ('locations', 'colorscale', 'name')},
+        'layout': figure['layout'],
+    }
+
+def load_slider_map():
+    return versions.current.slider_map_store.get()
+
+if slider_map_mode == 'client':
+    # Lazy graphs get the rank columns once the map is in view, then draw it
+    app.clientside_callback(
+        ClientsideFunction(namespace='slider_map', function_name='update'),
+        Output(component_id='slider-map-container', component_property='figure'),
+        Input(component_id='my-slider', component_property='value'),
+        (Input if graph_loading == 'lazy' else State)(component_id='slider-map-store', component_property='data'))
+    if graph_loading == 'lazy':
+        graph_callback('slider-map-container',
+            Output(component_id='slider-map-store', component_property='data'))(
+            callback_metrics.timed(graph_function(load_slider_map)))
+else:
+    graph_callback('slider-map-container',
+        Output(component_id='slider-map-container', component_property='figure'),
+        Input(component_id='my-slider', component_property='value'))(callback_metrics.timed(graph_function(update_output)))
+
+bubble_color_columns = {16:'Genus', 17:'Family', 18:'Region'}
+
+@figure_dicts.LayoutTemplate
+def bubble_layout():
+    # px's layout of the bubble chart; the axis and legend titles are set per figure
+    fig = px.scatter(
+        data_frame = pd.DataFrame({'x': [1.0], 'y': [1.0], 'Population': [1], 'Country': ['']}),
+        x='x',
+        y='y',
+        size="Population",
+        color=['color'],
+        hover_name="Country",
+        log_x=True,
+        size_max=60,
+    )
     fig.update_layout(
         margin={"r":0,"t":0,"l":0,"b":0},
         legend=dict(yanchor="top", y=-0.2, xanchor="left", x=0.01, orientation='h'),
@@ -217,6 +349,260 @@ def update_graph(option_slctd_1, option_slctd_2, option_slctd_3):
     )
     return fig
 
+def bubble_scatter(df, option_slctd_1, option_slctd_2, option_slctd_3, types, render_mode, color_discrete_map=None):
+    # types: the type at rank option_slctd_3 of every row of df, in rank modes
+    if option_slctd_3 > 15:
+        color = label = bubble_color_columns[option_slctd_3]
+    else:
+        # Modes below 16 are ranks, labelled like the MAX_*/MIN_* columns they come from
+        color, label, color_discrete_map = types, rank_column(option_slctd_3), colors_dict
+    traces = figure_dicts.scatter_groups(
+        df, option_slctd_1, option_slctd_2, "Population", color, "Country", label=label,
+        color_discrete_map=color_discrete_map, size_max=60, render_mode=render_mode)
+    return bubble_layout.figure(traces, {
+        ('xaxis', 'title', 'text'): option_slctd_1,
+        ('yaxis', 'title', 'text'): option_slctd_2,
+        ('legend', 'title', 'text'): label,
+    })
+
+def bubble_labels(data, mode):
+    # What the bubbles are colored by, for every row
+    if mode > 15:
+        return data.top_df[bubble_color_columns[mode]].to_numpy(dtype=object)
+    return data.country_ranks.types_at(mode)
+
+def bubble_grid(data, option_slctd_1, option_slctd_2):
+    # Rows by where they are drawn (the x axis is logarithmic)
+    top_df = data.top_df
+    return lod.GridIndex(lod.plot_space([top_df[option_slctd_1], top_df[option_slctd_2]], [True, False]))
+
+def bubble_lod_figure(data, option_slctd_1, option_slctd_2, option_slctd_3, window=None):
+    # More than LOD_THRESHOLD rows: bins of all rows or of those in a zoomed-in
+    # window, or the rows in the window themselves once there are few enough
+    top_df = data.top_df
+    grid = data.bubble_grids(option_slctd_1, option_slctd_2)
+    labels = bubble_labels(data, option_slctd_3)
+    # Subsets and bins keep the colors of the whole table
+    lod_args = {'color_discrete_map': lod.color_map(labels)} if option_slctd_3 > 15 else {}
+    lo, hi = window or (grid.lo, grid.hi)
+    rows = grid.rows if window is None else grid.query(lo, hi)
+    if window is not None and len(rows) <= lod.LOD_THRESHOLD:
+        fig = bubble_scatter(lod.subset(top_df, rows), option_slctd_1, option_slctd_2, option_slctd_3, labels[rows],
+                             render_policy.render_mode(len(rows)), **lod_args)
+    else:
+        bins = lod.aggregate(grid.points[rows], top_df['Population'].to_numpy()[rows], labels[rows], lo, hi, lod.LOD_BINS)
+        binned = pd.DataFrame({
+            option_slctd_1: 10 ** bins[0], 'Population': bins['weight'], 'Country': lod.names(bins['count']),
+        })
+        # With the same column on both axes the bins keep the x value, which
+        # puts them on the diagonal the rows themselves are drawn on
+        if option_slctd_2 != option_slctd_1:
+            binned[option_slctd_2] = bins[1]
+        if option_slctd_3 > 15:
+            binned[bubble_color_columns[option_slctd_3]] = bins['label']
+        fig = bubble_scatter(binned, option_slctd_1, option_slctd_2, option_slctd_3, bins['label'].to_numpy(),
+                             render_policy.render_mode(len(binned)), **lod_args)
+    if window is not None:
+        fig = figure_dicts.update_layout(fig, {('xaxis', 'range'): [lo[0], hi[0]], ('yaxis', 'range'): [lo[1], hi[1]]})
+    return fig
+
+def bubble_chart_figure(data, option_slctd_1, option_slctd_2, option_slctd_3):
+    if len(data.top_df) > lod.LOD_THRESHOLD:
+        return bubble_lod_figure(data, option_slctd_1, option_slctd_2, option_slctd_3)
+    types = data.country_ranks.types_at(option_slctd_3) if option_slctd_3 <= 15 else None
+    return bubble_scatter(data.top_df, option_slctd_1, option_slctd_2, option_slctd_3, types,
+                          render_policy.render_mode(len(data.top_df)))
+
+def update_graph(option_slctd_1, option_slctd_2, option_slctd_3):
+    return versions.current.bubble_chart_cache.get(option_slctd_1, option_slctd_2, option_slctd_3)
+
+if callback_mode == 'static':
+    app.clientside_callback(
+        ClientsideFunction(namespace='static_figures', function_name='bubble_chart'),
+        Output(component_id='my_bubble_chart', component_property='figure'),
+        [Input(component_id='slct_chart_1', component_property='value'),
+         Input(component_id='slct_chart_2', component_property='value'),
+         Input(component_id='slct_chart_3', component_property='value')],
+        State(component_id='slct_chart_1', component_property='options'))
+else:
+    figure_callback('my_bubble_chart',
+         Output(component_id='my_bubble_chart', component_property='figure'),
+        [Input(component_id='slct_chart_1', component_property='value'),
+         Input(component_id='slct_chart_2', component_property='value'),
+         Input(component_id='slct_chart_3', component_property='value')])(update_graph)
+
+def bubble_window(relayout, grid):
+    # The plot space window of a zoom or pan; axes it leaves out stay whole
+    lo, hi = grid.lo.copy(), grid.hi.copy()
+    zoomed = False
+    for axis, name in enumerate(('xaxis', 'yaxis')):
+        bounds = relayout.get(name + '.range') or [relayout.get(name + '.range[0]'), relayout.get(name + '.range[1]')]
+        if None not in bounds:
+            lo[axis], hi[axis] = sorted(float(bound) for bound in bounds)
+            zoomed = True
+    return (lo, hi) if zoomed else None
+
+def zoom_graph(relayout, option_slctd_1, option_slctd_2, option_slctd_3):
+    # Only binned charts change with the zoom
+    data = versions.current
+    if not relayout or len(data.top_df) <= lod.LOD_THRESHOLD:
+        raise PreventUpdate
+    if any(key.endswith('autorange') for key in relayout):
+        return data.bubble_chart_cache.get(option_slctd_1, option_slctd_2, option_slctd_3)
+    window = bubble_window(relayout, data.bubble_grids(option_slctd_1, option_slctd_2))
+    if window is None:
+        raise PreventUpdate
+    figure = bubble_lod_figure(data, option_slctd_1, option_slctd_2, option_slctd_3, window)
+    return compact_figure(figure, 'my_bubble_chart')
+
+if callback_mode != 'static':
+    app.callback(
+        Output(component_id='my_bubble_chart', component_property='figure', allow_duplicate=True),
+        Input(component_id='my_bubble_chart', component_property='relayoutData'),
+        [State(component_id='slct_chart_1', component_property='value'),
+         State(component_id='slct_chart_2', component_property='value'),
+         State(component_id='slct_chart_3', component_property='value')],
+        prevent_initial_call=True)(callback_metrics.timed(zoom_graph))
+
+def placeholder_figure(height=450):
+    # A lazy graph until its figure comes: nothing, at the figure's height
+    return {'data': [], 'layout': {'height': height, 'paper_bgcolor': 'rgba(0,0,0,0)', 'plot_bgcolor': 'rgba(0,0,0,0)',
+                                   'xaxis': {'visible': False}, 'yaxis': {'visible': False}}}
+
+def page_graph(graph, figure, height=450):
+    if graph_loading != 'lazy':
+        return dcc.Graph(id=graph, figure=figure)
+    return html.Div([
+        dcc.Store(id=visible_store(graph), data=False),
+        dcc.Graph(id=graph, figure=placeholder_figure(height), className='lazy-graph'),
+    ])
+
+# Figures built once per data version; embedded in the layout, or sent by a
+# callback once lazy graphs come into view
+embedded_figures = {
+    'max_fig_0': lambda: versions.current.max_figs[0],
+    'max_fig_1': lambda: versions.current.max_figs[1],
+    'fig_3D': lambda: versions.current.fig_3D,
+}
+
+def embedded_figure(graph):
+    def load_figure():
+        return embedded_figures[graph]().get()
+    return load_figure
+
+if graph_loading == 'lazy':
+    for graph in embedded_figures:
+        graph_callback(graph, Output(component_id=graph, component_property='figure'))(
+            callback_metrics.timed(graph_function(embedded_figure(graph))))
+
+def derive_countries(data):
+    # Everything built from top_top.csv; figures are built on first use
+    top_df = data.tables['top_top.csv']
+    if shares_file:
+        top_df = rank_tables.with_ranks(top_df, data.tables[shares_file])
+    derived = {
+        'top_df': top_df,
+        # Personality ranks coded against the colors_dict type table; rank 0 is the most common type
+        'country_ranks': RankMatrix.from_rank_columns(top_df, 'Country', colors_dict),
+        'fig_3D': Lazy('fig_3D', compacted(partial(fig_3D_figure, data), 'fig_3D')),
+        'max_figs': [Lazy('max_figs[{}]'.format(i), partial(compacted(max_fig_figure, 'max_figs'), data, i))
+                     for i in range(2)],
+        # The slider only has 16 positions, so every map is built once and served from the bank
+        'slider_map_bank': FigureBank(compacted(partial(slider_map_figure, data), 'slider-map-container'), range(16)),
+        # 8 x 8 metrics and 19 color modes make 1,216 figures, too many to prebuild
+        # Grid indexes of the bubble chart axes, for level of detail
+        'bubble_grids': lru_cache(maxsize=32)(partial(bubble_grid, data)),
+        'bubble_chart_cache': FigureCache(compacted(partial(bubble_chart_figure, data), 'my_bubble_chart'),
+                                          maxsize=int(os.environ.get('BUBBLE_CACHE_SIZE', 256))),
+    }
+    if slider_map_mode == 'client':
+        derived['slider_map_store'] = Lazy('slider_map_store', partial(slider_map_data, data))
+        slider_map = derived['slider_map_store']
+    else:
+        derived['slider_map_store'] = None
+        slider_map = Lazy('slider_map_bank', derived['slider_map_bank'].warm)
+    derived['page_figures'] = [derived['fig_3D'], *derived['max_figs'], slider_map]
+    return derived
+
+def derive_labels(name, default):
+    # gen_max.csv / fam_max.csv: a column per genus or family, a row per rank,
+    # then a <label>_T column of totals per label. The dropdown starts on the
+    # labels of default this data has
+    def derive(data):
+        df = data.tables['{}_max.csv'.format(name)]
+        labels = [x for x in df.columns if not x.endswith('_T')]
+        return {
+            name + '_df': df,
+            name + '_labels': labels,
+            name + '_ranks': RankMatrix.from_label_columns(df, labels, colors_dict),
+            name + '_options': [{'label':x, 'value':x} for x in labels],
+            name + '_default': [x for x in default if x in labels],
+        }
+    return derive
+
+def warm_figures(data=None):
+    for lazy in (data or versions.current).page_figures:
+        lazy.get()
+    return {name: round(seconds * 1000, 1) for name, seconds in build_times.items()}
+
+versions.derive(country_files, derive_countries)
+versions.derive(['gen_max.csv'], derive_labels('gen', ['Germanic', 'Romance', 'Slavic']))
+versions.derive(['fam_max.csv'], derive_labels('fam', ['Afro-Asiatic', 'Turkic', 'Sino-Tibetian']))
+if figure_mode == 'eager':
+    # New versions too are built in the background before they are swapped in
+    versions.prepare.append(warm_figures)
+versions.load_current()
+# Files are polled every DATA_RELOAD_INTERVAL seconds; 0 turns reloading off
+versions.watch(server, float(os.environ.get('DATA_RELOAD_INTERVAL', 5)))
+
+def etag_version(data):
+    # Set DATA_VERSION to invalidate cached callback responses without a data change
+    return ':'.join(filter(None, [os.environ.get('DATA_VERSION'), data.version]))
+
+callback_etags = CallbackETags(app, etag_version(versions.current), max_age=int(os.environ.get('CALLBACK_MAX_AGE', 0)))
+# Only after the swap: a response tagged with the old version may carry new
+# data, which is refetched, never the other way round
+versions.listeners.append(lambda new, old: setattr(callback_etags, 'version', etag_version(new)))
+# The page layout embeds figures and options of the current data, so it is
+# serialized and compressed once per version
+cached_layout = CachedLayout(app, etag_version(versions.current))
+versions.listeners.append(lambda new, old: setattr(cached_layout, 'version', etag_version(new)))
+# Every callback is registered by now
+callback_metrics.instrument(app)
+# PROFILE_SAMPLE=N profiles one in N callback requests into PROFILE_DIR;
+# unset, nothing is hooked in. After the ETags, so a 304 is never profiled
+if os.environ.get('PROFILE_SAMPLE'):
+    request_profiler = RequestProfiler(app, int(os.environ['PROFILE_SAMPLE']), os.environ.get('PROFILE_DIR', 'profiles'),
+                                       float(os.environ.get('PROFILE_INTERVAL', 0.001)))
+
+@server.route('/healthz')
+def healthz():
+    return {'status': 'ok'}
+
+@server.route('/readyz')
+def readyz():
+    data = versions.current
+    return {
+        'status': 'ready',
+        'countries': len(data.top_df),
+        'callback_mode': callback_mode,
+        'slider_map_mode': slider_map_mode,
+        'graph_loading': graph_loading,
+        'figure_mode': figure_mode,
+        'data': versions.info(),
+        'warm': all(lazy.built for lazy in data.page_figures),
+        # Counts of this worker; the figure cache is per data version
+        'caches': {
+            'bubble_chart': data.bubble_chart_cache.info(),
+            'callback_etags': callback_etags.info(),
+            'layout': cached_layout.info(),
+        },
+    }
+
+@server.route('/warmup')
+def warmup():
+    return {'status': 'warm', 'build_ms': warm_figures()}
+
 navbar = dbc.Navbar([
     dbc.Container([
         dbc.Row([
@@ -478,14 +864,14 @@ container = dbc.Container([
     dbc.Row([
         dbc.Col([
             html.H4('Most common personality type per country'),
-            dcc.Graph(figure=max_figs[0]),
+            page_graph('max_fig_0', Live(embedded_figures['max_fig_0']), height=300),
         ], 
             xs=12, sm=12, md=12, lg=6, xl=6,
         ),
         
         dbc.Col([
             html.H4('Second most common personality type per country'),
-            dcc.Graph(figure=max_figs[1]),
+            page_graph('max_fig_1', Live(embedded_figures['max_fig_1']), height=300),
         ] ,  
             xs=12, sm=12, md=12, lg=6, xl=6,
         ),
@@ -544,7 +930,8 @@ container = dbc.Container([
     dbc.Row([
         dbc.Col([
             html.Div([
-                dcc.Graph(id='slider-map-container', figure={}),
+                dcc.Store(id='slider-map-store', data=None if graph_loading == 'lazy' else Live(lambda: versions.current.slider_map_store)),
+                page_graph('slider-map-container', {}),
                 dcc.Slider(
                     0, 15, step=1,
                     marks={
@@ -654,7 +1041,8 @@ container = dbc.Container([
         dbc.Col([
             html.Div([
                 html.Br(),
-                dcc.Graph(id='my_bubble_chart', figure={}),
+                html.Div(id='my_bubble_chart_status', className='figure-status', style={'display': 'none'}),
+                page_graph('my_bubble_chart', {}),
                 dcc.Slider(
                     0, 18, step=1,
                     marks={
@@ -711,7 +1099,7 @@ container = dbc.Container([
     
     dbc.Row([
         dbc.Col([
-            dcc.Graph(figure=fig_3D),
+            page_graph('fig_3D', Live(embedded_figures['fig_3D']), height=800),
         ], xs=12, sm=12, md=12, lg=12, xl=12),
     ], 
         justify='around',
@@ -743,13 +1131,15 @@ container = dbc.Container([
         dbc.Col([
             html.Div([
                 dcc.Dropdown(id='gen_go_dropdown',
-                             options=gen_options,
+                             options=Live(lambda: versions.current.gen_options),
                              multi=True,
-                             value=['Germanic', 'Romance', 'Slavic'],
+                             value=Live(lambda: versions.current.gen_default),
                              style={'width':'100%', 'color':'#000000'}
                             ),
                 html.Br(),
-                dcc.Graph(id='gen_go_bubble', figure={}),
+                dcc.Store(id='gen_go_shown'),
+                html.Div(id='gen_go_bubble_status', className='figure-status', style={'display': 'none'}),
+                page_graph('gen_go_bubble', {}),
                 html.Br(),
                 html.P(
                     '''
@@ -771,13 +1161,15 @@ container = dbc.Container([
         dbc.Col([
             html.Div([
                 dcc.Dropdown(id='fam_go_dropdown',
-                             options=fam_options,
+                             options=Live(lambda: versions.current.fam_options),
                              multi=True,
-                             value=['Afro-Asiatic','Turkic','Sino-Tibetian'],
+                             value=Live(lambda: versions.current.fam_default),
                              style={'width':'100%', 'color':'#000000'}
                             ),
                 html.Br(),
-                dcc.Graph(id='fam_go_bubble', figure={}),
+                dcc.Store(id='fam_go_shown'),
+                html.Div(id='fam_go_bubble_status', className='figure-status', style={'display': 'none'}),
+                page_graph('fam_go_bubble', {}),
                 html.Br(),
                 html.P(
                     '''
@@ -883,5 +1275,10 @@ app.layout = dbc.Container(
     fluid=True, style={"padding":0}
 )
 
+print('app imported in {:.0f} ms ({} figures): {}'.format(
+    (time.perf_counter() - import_started) * 1000, figure_mode,
+    ', '.join('{} {:.0f} ms'.format(name, seconds * 1000) for name, seconds in build_times.items()) or 'none built'),
+    file=sys.stderr)
+
 if __name__ == '__main__':
     app.run_server(debug=False, host='0.0.0.0', port=8080)
\ No newline at end of file
@@ -0,0 +1,35 @@
+// Lazy graphs (GRAPH_LOADING=lazy): every graph with the lazy-graph class
+// starts empty, and once it comes within a screen of the viewport this sets
+// the data of its '<id>_visible' store, which runs the callbacks drawing it.
+(function() {
+    function show(graph) {
+        window.dash_clientside.set_props(graph.id + '_visible', {data: true});
+    }
+
+    // Without IntersectionObserver every graph is drawn at once
+    var observer = 'IntersectionObserver' in window && new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                show(entry.target);
+            }
+        });
+    }, {rootMargin: '100% 0px'});
+    var watched = new WeakSet();
+
+    function watch() {
+        document.querySelectorAll('.lazy-graph').forEach(function(graph) {
+            if (!watched.has(graph)) {
+                watched.add(graph);
+                if (observer) {
+                    observer.observe(graph);
+                } else {
+                    show(graph);
+                }
+            }
+        });
+    }
+
+    // The renderer adds the graphs after the assets have run
+    new MutationObserver(watch).observe(document.documentElement, {childList: true, subtree: true});
+})();
@@ -0,0 +1,33 @@
+// Client-side slider map: recolors the choropleth from the rank columns shipped
+// once in 'slider-map-store', rebuilding the same single map trace and legend
+// entries the server's DiscreteChoropleth sends.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    slider_map: {
+        update: function(value, store) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            var codes = store.ranks[value];
+            var trace = Object.assign({}, store.trace, {
+                z: codes,
+                text: codes.map(function(code) { return store.types[code]; })
+            });
+            var traces = [trace];
+            var seen = {};
+            for (var i = 0; i < codes.length; i++) {
+                var code = codes[i];
+                if (seen[code]) {
+                    continue;
+                }
+                seen[code] = true;
+                var color = store.colors[code];
+                traces.push(Object.assign({}, store.legend_trace, {
+                    locations: [trace.locations[i]],
+                    colorscale: [[0.0, color], [1.0, color]],
+                    name: store.types[code]
+                }));
+            }
+            return {data: traces, layout: store.layout};
+        }
+    }
+});
@@ -0,0 +1,50 @@
+// Client-side callbacks for the static export (CALLBACK_MODE=static): figures
+// are read from the JSON files static_export.py writes under figures/.
+(function() {
+    // Text rather than parsed figures is kept, since plotly mutates the
+    // figures it is given
+    var files = {};
+
+    function load(path) {
+        if (!files[path]) {
+            files[path] = fetch(path).then(function(response) {
+                if (!response.ok) {
+                    delete files[path];
+                    throw new Error(path + ': ' + response.status);
+                }
+                return response.text();
+            });
+        }
+        return files[path].then(JSON.parse);
+    }
+
+    function bubbles(name, value) {
+        return load('figures/' + name + '.json').then(function(figures) {
+            return {
+                data: (value || []).map(function(label) { return figures.traces[label]; }),
+                layout: figures.layout
+            };
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        static_figures: {
+            bubble_chart: function(x, y, mode, options) {
+                // Files are named by option position, metric names hold '$' and '^'
+                var values = options.map(function(option) { return option.value; });
+                var i = values.indexOf(x);
+                var j = values.indexOf(y);
+                if (i < 0 || j < 0 || mode === null || mode === undefined) {
+                    return window.dash_clientside.no_update;
+                }
+                return load('figures/bubble/' + i + '-' + j + '-' + mode + '.json');
+            },
+            genus: function(value) {
+                return bubbles('genus', value);
+            },
+            family: function(value) {
+                return bubbles('family', value);
+            }
+        }
+    });
+})();
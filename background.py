@@ -0,0 +1,102 @@
+'''
+Background execution of the expensive callbacks (CALLBACK_MODE=background).
+
+The bubble chart and the genus/family charts run as Dash background callbacks
+under a DiskcacheManager: the request only starts a job and returns, and the
+browser polls for the result, so a slow figure never holds a gunicorn thread.
+The renderer cancels a job that is still running when its inputs change
+again. Results are kept in the disk cache per data version, so every worker
+shares the figures any of them built; a result already in the cache is
+answered without starting a job at all.
+
+Each job is a process of its own. WorkerSlots caps how many of them build at
+once across all workers: a job that finds every slot taken waits for one,
+reporting that as progress, and builds once it gets it, so a busy server
+queues updates instead of dropping them. A waiting job only sleeps; cancelling
+it (a superseded input) kills it like a building one. A slot is an flock on a
+file, so a finished or killed job frees its slot.
+
+Needs the dash[diskcache] extras (diskcache, multiprocess, psutil).
+'''
+
+import fcntl
+import functools
+import os
+import time
+
+from dash import DiskcacheManager
+
+QUEUED = 'Waiting for a free worker...'
+BUILDING = 'Building the figure...'
+
+
+def manager(directory, cache_by=None, expire=None):
+    try:
+        import diskcache
+    except ImportError:
+        raise ImportError('CALLBACK_MODE=background needs pip install "dash[diskcache]"')
+    return CachedJobManager(diskcache.Cache(directory), cache_by=cache_by, expire=expire)
+
+
+class CachedJobManager(DiskcacheManager):
+    '''
+    A DiskcacheManager that starts no job for a result already in the cache.
+    '''
+
+    def call_job_fn(self, key, job_fn, args, context):
+        # Job 0 is no process: the first poll returns the cached result
+        if self.result_ready(key):
+            return 0
+        return super().call_job_fn(key, job_fn, args, context)
+
+    def terminate_job(self, job):
+        if job is not None and int(job):
+            super().terminate_job(job)
+
+    def job_running(self, job):
+        return bool(job) and bool(int(job)) and super().job_running(job)
+
+
+class WorkerSlots:
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = max(1, size)
+        os.makedirs(directory, exist_ok=True)
+
+    def _try(self, i):
+        f = open(os.path.join(self.directory, 'slot-{}.lock'.format(i)), 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def acquire(self, waiting=None, poll=0.05):
+        # Blocks until a slot is free; waiting() is called once if it has to wait
+        while True:
+            for i in range(self.size):
+                f = self._try(i)
+                if f is not None:
+                    return f
+            if waiting is not None:
+                waiting()
+                waiting = None
+            time.sleep(poll)
+
+    def job(self, fn):
+        '''
+        fn as a background callback body: takes set_progress first and builds
+        only while holding a slot.
+        '''
+        # functools.wraps also makes Dash key the results on fn's source
+        @functools.wraps(fn)
+        def run(set_progress, *args):
+            f = self.acquire(lambda: set_progress(QUEUED))
+            try:
+                set_progress(BUILDING)
+                return fn(*args)
+            finally:
+                f.close()
+        return run
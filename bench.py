@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Micro-benchmarks for the app's callbacks.
+
+Every callback is called directly, with its figure caches cleared, across its
+input space: the 16 slider positions, the 1,216 bubble-chart combinations and
+a set of representative genus/family multi-selects. For every case it records
+the build time, the time and size of the JSON Dash would send, and peak
+Python memory.
+
+    python bench.py             run and compare against the baseline
+    python bench.py --save      run and store the results as the new baseline
+    python bench.py --quick     only every 10th bubble-chart combination
+    python bench.py --no-memory skip the peak memory pass, which is slow
+
+A slower median, bigger payloads or higher peak memory than the baseline
+(beyond --tolerance) is reported and makes the run exit with status 1.
+
+Timings belong to the machine they were taken on, so the baseline is not
+committed (bench_baseline.json is ignored). Record one on the machine that
+runs the check, from the commit to compare against:
+
+    git checkout <base> && python bench.py --save
+    git checkout <change> && python bench.py
+
+Without a baseline the comparison is skipped with a message on stderr; with
+--require-baseline (for CI) that is an error, exit status 2.
+'''
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Register every callback on the server and build nothing at import
+os.environ['SLIDER_MAP_MODE'] = 'server'
+os.environ['GRAPH_LOADING'] = 'eager'
+os.environ['FIGURE_MODE'] = 'lazy'
+os.environ['DATA_RELOAD_INTERVAL'] = '0'
+# Measure the bytes compaction saves on every figure
+os.environ['PAYLOAD_SAMPLE'] = '1'
+
+from plotly.io.json import to_json_plotly
+
+import app
+import payload
+
+BASELINE = 'bench_baseline.json'
+
+
+def callback(output):
+    for key, entry in app.app.callback_map.items():
+        if key.startswith('..{}.'.format(output)) or key == output:
+            return entry['callback'].__wrapped__
+    raise KeyError(output)
+
+
+def clear_caches():
+    data = app.versions.current
+    data.slider_map_bank.clear()
+    data.bubble_chart_cache.clear()
+
+
+def multi_selects(labels, default):
+    cases = [('default', default, None), ('all', labels, None), ('first 5', labels[:5], None)]
+    cases += [('single {}'.format(label), [label], None) for label in labels]
+    extra = next(label for label in labels if label not in default)
+    shown = {'version': app.versions.current.version, 'traces': default}
+    cases.append(('add one to default', default + [extra], shown))
+    cases.append(('remove one from default', default[1:], shown))
+    return cases
+
+
+def cases(quick=False):
+    layout = app.app.layout
+    metrics = [option['value'] for option in layout['slct_chart_1'].options]
+    modes = sorted(layout['slct_chart_3'].marks)
+
+    update_output = callback('slider-map-container.figure')
+    for value in range(16):
+        yield 'update_output', str(value), lambda value=value: update_output(value)
+
+    update_graph = callback('my_bubble_chart.figure')
+    combos = [(x, y, mode) for x in metrics for y in metrics for mode in modes]
+    for i, (x, y, mode) in enumerate(combos):
+        if quick and i % 10:
+            continue
+        yield 'update_graph', '{} / {} / {}'.format(x, y, mode), lambda x=x, y=y, mode=mode: update_graph(x, y, mode)
+
+    data = app.versions.current
+    for name, dropdown, labels, default in (('update_gen (genus)', 'gen_go', data.gen_labels, data.gen_default),
+                                            ('update_gen (family)', 'fam_go', data.fam_labels, data.fam_default)):
+        update_gen = callback('{}_bubble.figure'.format(dropdown))
+        for label, value, shown in multi_selects(labels, default):
+            yield name, label, lambda value=value, shown=shown: update_gen(value, shown)
+
+
+def measure(call, repeat=3, memory=True):
+    # Best of `repeat` timings, which is far less noisy than a single run
+    build, serialize = [], []
+    for _ in range(repeat):
+        clear_caches()
+        gc.collect()
+        started = time.perf_counter()
+        output = call()
+        built = time.perf_counter()
+        text = to_json_plotly(output)
+        build.append(built - started)
+        serialize.append(time.perf_counter() - built)
+    result = {
+        'build_ms': min(build) * 1000,
+        'json_ms': min(serialize) * 1000,
+        'bytes': len(text),
+        'peak_kb': 0.0,
+    }
+    if memory:
+        clear_caches()
+        gc.collect()
+        tracemalloc.start()
+        to_json_plotly(call())
+        result['peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return result
+
+
+def summarize(results):
+    groups = {}
+    for result in results.values():
+        groups.setdefault(result['callback'], []).append(result)
+    summary = {}
+    for name, group in groups.items():
+        total = sorted(r['build_ms'] + r['json_ms'] for r in group)
+        summary[name] = {
+            'cases': len(group),
+            'median_ms': statistics.median(total),
+            'p95_ms': total[int(0.95 * (len(total) - 1))],
+            'median_json_ms': statistics.median(r['json_ms'] for r in group),
+            'mean_bytes': statistics.mean(r['bytes'] for r in group),
+            'max_bytes': max(r['bytes'] for r in group),
+            'max_peak_kb': max(r['peak_kb'] for r in group),
+        }
+    return summary
+
+
+def report(summary):
+    print('{:<22}{:>7}{:>11}{:>9}{:>10}{:>12}{:>11}'.format(
+        'callback', 'cases', 'median ms', 'p95 ms', 'json ms', 'mean bytes', 'peak KB'))
+    for name, s in summary.items():
+        print('{:<22}{:>7}{:>11.1f}{:>9.1f}{:>10.2f}{:>12.0f}{:>11.0f}'.format(
+            name, s['cases'], s['median_ms'], s['p95_ms'], s['median_json_ms'], s['mean_bytes'], s['max_peak_kb']))
+
+
+def report_savings():
+    print('\n{:<22}{:>9}{:>14}{:>13}{:>8}'.format('payload', 'figures', 'bytes before', 'bytes after', 'saved'))
+    for name, s in payload.report().items():
+        print('{:<22}{:>9}{:>14}{:>13}{:>7.0%}'.format(
+            name, s['figures'], s['bytes_before'], s['bytes_after'], s['saved'] / max(s['bytes_before'], 1)))
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for name, base in baseline['summary'].items():
+        current = summary.get(name)
+        if current is None:
+            continue
+        for key, allowed in (('median_ms', tolerance), ('max_peak_kb', tolerance),
+                             ('mean_bytes', 0.01), ('max_bytes', 0.01)):
+            # Runs with --no-memory record no peak
+            if current[key] and current[key] > base[key] * (1 + allowed):
+                found.append('{}: {} {:.1f} -> {:.1f}'.format(name, key, base[key], current[key]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app callbacks.')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--quick', action='store_true', help='sample every 10th bubble-chart combination')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per case, best is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slow) tracemalloc pass')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--require-baseline', action='store_true',
+                        help='fail instead of skipping the comparison when there is no baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown / memory growth (default 0.25)')
+    args = parser.parse_args()
+
+    results = {}
+    for name, label, call in cases(args.quick):
+        result = measure(call, args.repeat, not args.no_memory)
+        result['callback'] = name
+        results['{}: {}'.format(name, label)] = result
+    summary = summarize(results)
+    report(summary)
+    report_savings()
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'summary': summary, 'cases': results}, f, indent=1)
+        print('saved baseline to {}'.format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print('SKIPPED regression check: no baseline at {}; record one with python bench.py --save'.format(
+            args.baseline), file=sys.stderr)
+        return 2 if args.require_baseline else 0
+    with open(args.baseline) as f:
+        found = regressions(summary, json.load(f), args.tolerance)
+    for line in found:
+        print('REGRESSION ' + line, file=sys.stderr)
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
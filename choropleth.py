@@ -0,0 +1,89 @@
+'''
+Single-trace discrete choropleth.
+
+px.choropleth with a color_discrete_map emits one trace per category, each
+with its own locations and hover arrays. DiscreteChoropleth draws the same map
+with one go.Choropleth: z holds the integer category codes and a stepped
+colorscale, built once from the color table, gives every code its color.
+
+The legend is kept with one tiny surrogate trace per category shown: it
+repeats the first location of that category in the category's color (drawn
+over the identical polygon, hover disabled), so the legend lists the same
+entries, in the same order of first appearance, as px's. Clicking such an
+entry could only hide its swatch, not the category's countries, so the legend
+is a key only: base_figure() turns legend clicks off.
+
+The traces are plain dicts (figure_dicts.py); base_figure() gives the layout
+all the maps share, for their layout templates.
+'''
+
+import numpy as np
+import plotly.graph_objects as go
+
+from figure_dicts import trace
+
+
+class DiscreteChoropleth:
+
+    def __init__(self, colors):
+        # colors: category -> color, in code order
+        self.categories = list(colors)
+        self.colors = [colors[c] for c in self.categories]
+        n = len(self.categories)
+        self.colorscale = []
+        for code, color in enumerate(self.colors):
+            self.colorscale += [[code / n, color], [(code + 1) / n, color]]
+        # Code k maps to the middle of its band
+        self.zmin = -0.5
+        self.zmax = n - 0.5
+
+    def legend_traces(self, locations, codes):
+        seen, first = np.unique(codes, return_index=True)
+        traces = []
+        for code, index in sorted(zip(seen, first), key=lambda pair: pair[1]):
+            color = self.colors[code]
+            traces.append(trace(
+                'choropleth',
+                locations=[locations[index]],
+                z=[1],
+                colorscale=[[0.0, color], [1.0, color]],
+                showscale=False,
+                name=self.categories[code],
+                showlegend=True,
+                hoverinfo='skip',
+            ))
+        return traces
+
+    def traces(self, locations, codes, hovertext=None, customdata=None, hover_labels=(), label='Type'):
+        '''
+        locations: ISO-3 codes; codes: category code per location.
+        hover_labels names the customdata columns shown on hover.
+        '''
+        locations = np.asarray(locations, dtype=object)
+        codes = np.asarray(codes)
+        hovertemplate = '<b>%{hovertext}</b><br><br>' + label + '=%{text}<br>Alpha-3 code=%{location}'
+        for i, name in enumerate(hover_labels):
+            hovertemplate += '<br>{}=%{{customdata[{}]}}'.format(name, i)
+        map_trace = trace(
+            'choropleth',
+            locations=locations,
+            z=codes,
+            zmin=self.zmin,
+            zmax=self.zmax,
+            colorscale=self.colorscale,
+            showscale=False,
+            showlegend=False,
+            text=np.asarray(self.categories, dtype=object)[codes],
+            hovertext=hovertext,
+            customdata=customdata,
+            hovertemplate=hovertemplate + '<extra></extra>',
+        )
+        return [map_trace] + self.legend_traces(locations, codes)
+
+    def base_figure(self, label='Type'):
+        fig = go.Figure()
+        fig.update_layout(
+            geo=dict(domain=dict(x=[0.0, 1.0], y=[0.0, 1.0]), center={}),
+            legend=dict(title=dict(text=label), tracegroupgap=0, itemclick=False, itemdoubleclick=False),
+        )
+        return fig
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Binary columnar cache for the CSV tables.
+
+The first read of a CSV parses it once and writes every column as a .npy file
+into a directory named after the CSV's content hash. Text columns are
+dictionary encoded (integer codes plus a category list). Later reads memory-map
+those files instead of parsing text: numeric columns stay read-only views of
+the files, shared through the page cache by every process. Low-cardinality
+text columns come back as pandas categoricals and the rest as plain object
+columns.
+
+    python data_cache.py top_top.csv gen_max.csv fam_max.csv
+
+prebuilds the caches, e.g. at image build time.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', '.data_cache')
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(path, cache_dir=CACHE_DIR, digest=None):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, '{}-{}'.format(stem, (digest or file_hash(path))[:16]))
+
+
+def write_cache(df, target):
+    columns = []
+    for name in df.columns:
+        col = df[name]
+        if col.dtype == object:
+            cat = pd.Categorical(col)
+            columns.append((name, cat.codes, cat.categories.tolist()))
+        else:
+            columns.append((name, col.to_numpy(), None))
+    write_columns(columns, len(df), target)
+
+
+def write_columns(columns, rows, target):
+    '''
+    columns: (name, values, categories) per column; text columns as integer
+    codes into categories, numeric ones with categories None.
+    '''
+    # Written into a temporary directory and renamed into place, so a reader
+    # never sees a half written cache
+    parent = os.path.dirname(target) or '.'
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    meta = []
+    for i, (name, values, categories) in enumerate(columns):
+        np.save(os.path.join(tmp, '{}.npy'.format(i)), values)
+        if categories is None:
+            meta.append({'name': name, 'kind': 'numeric'})
+        else:
+            meta.append({'name': name, 'kind': 'text', 'categories': list(categories)})
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'rows': rows, 'columns': meta}, f)
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # Another process got there first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_cache(target):
+    with open(os.path.join(target, 'meta.json')) as f:
+        meta = json.load(f)
+    data = {}
+    for i, col in enumerate(meta['columns']):
+        values = np.load(os.path.join(target, '{}.npy'.format(i)), mmap_mode='r')
+        if col['kind'] == 'text':
+            values = pd.Categorical.from_codes(values, col['categories'])
+            if len(col['categories']) > meta['rows'] // 2:
+                values = values.astype(object)
+        data[col['name']] = values
+    # Without a copy pandas (2.0 on) keeps a block per column instead of
+    # consolidating them into one in-memory array, so numeric columns stay
+    # views of the mapped files
+    return pd.DataFrame(data, copy=False)
+
+
+def version(paths):
+    # One short digest over the content of several files
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()[:16]
+
+
+def remove_stale(path, keep, cache_dir=CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if not os.path.isdir(cache_dir):
+        return
+    for entry in os.listdir(cache_dir):
+        full = os.path.join(cache_dir, entry)
+        if entry.rsplit('-', 1)[0] == stem and full != keep:
+            shutil.rmtree(full, ignore_errors=True)
+
+
+def read_csv(path, cache_dir=CACHE_DIR):
+    '''
+    Drop-in for pd.read_csv(path) that goes through the binary cache.
+
+    The cache is keyed on the CSV's content hash, so editing the CSV
+    invalidates it. An unwritable cache directory falls back to parsing.
+    '''
+    target = cache_path(path, cache_dir)
+    if not os.path.isdir(target):
+        df = pd.read_csv(path)
+        try:
+            write_cache(df, target)
+            remove_stale(path, target, cache_dir)
+        except OSError:
+            return df
+    return read_cache(target)
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        df = read_csv(path)
+        print('{}: {} rows -> {}'.format(path, len(df), cache_path(path)))
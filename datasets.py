@@ -0,0 +1,159 @@
+'''
+Hot-reloadable, versioned data.
+
+A Snapshot is one consistent version of the CSV tables plus everything the
+app derives from them: rank matrices, figure caches, dropdown options.
+DataVersions polls the files. Once a changed file has also held still for one
+more poll, the new version is loaded in the watcher thread and swapped in by a
+single reference assignment. A request reads `versions.current` once and works
+on that snapshot throughout, so it never mixes two versions; requests already
+running finish on the old one.
+
+Derived values are registered per group of files with derive(). When a
+version changes only some files, the groups that depend on the others are
+carried over from the previous snapshot, figures already built included. Only
+caches of a changed file start empty.
+'''
+
+import hashlib
+import os
+import threading
+import time
+import traceback
+
+import data_cache
+
+
+class Snapshot:
+
+    def __init__(self, hashes, tables):
+        self.hashes = hashes
+        self.tables = tables
+        digest = hashlib.sha256()
+        for path in sorted(hashes):
+            digest.update(hashes[path].encode())
+        self.version = digest.hexdigest()[:16]
+        self.loaded = time.time()
+        self.derived = []
+
+    def changed(self, previous, *paths):
+        return previous is None or any(self.hashes[p] != previous.hashes[p] for p in paths)
+
+
+class DataVersions:
+
+    def __init__(self, paths, load=data_cache.read_csv):
+        self.paths = list(paths)
+        self.load = load
+        self.current = None
+        self.interval = 0
+        self.reloads = 0
+        self.last_error = None
+        # Called with a new snapshot before it is swapped in, e.g. to build its figures
+        self.prepare = []
+        # Called with (new, old) after a swap
+        self.listeners = []
+        self._groups = []
+        self._signature = None
+        self._pending = None
+        self._watcher_pid = None
+        self._lock = threading.Lock()
+
+    def derive(self, paths, build):
+        '''
+        build(snapshot) returns {attribute: value} computed from the tables of
+        paths (and attributes of groups registered before it).
+        '''
+        self._groups.append((list(paths), build))
+
+    def signature(self):
+        return tuple((s.st_mtime_ns, s.st_size) for s in map(os.stat, self.paths))
+
+    def snapshot(self, previous=None):
+        hashes = {path: data_cache.file_hash(path) for path in self.paths}
+        if previous is not None and hashes == previous.hashes:
+            return previous
+        tables = {}
+        for path in self.paths:
+            if previous is not None and hashes[path] == previous.hashes[path]:
+                tables[path] = previous.tables[path]
+            else:
+                tables[path] = self.load(path)
+        data = Snapshot(hashes, tables)
+        for i, (paths, build) in enumerate(self._groups):
+            values = build(data) if data.changed(previous, *paths) else previous.derived[i]
+            data.derived.append(values)
+            data.__dict__.update(values)
+        return data
+
+    def _swap(self, new):
+        for hook in self.prepare:
+            hook(new)
+        old, self.current = self.current, new
+        for listener in self.listeners:
+            listener(new, old)
+
+    def load_current(self):
+        self._signature = self.signature()
+        self._swap(self.snapshot())
+        return self.current
+
+    def poll(self):
+        '''
+        Checks the files once. Returns True when a new version was swapped in.
+        '''
+        signature = self.signature()
+        if signature == self._signature:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            # Possibly still being written; wait for it to hold still
+            self._pending = signature
+            return False
+        self._pending = None
+        # A file that fails to load is not retried until it changes again
+        self._signature = signature
+        new = self.snapshot(self.current)
+        if new is self.current:
+            return False
+        self._swap(new)
+        self.reloads += 1
+        return True
+
+    def watch(self, server, interval):
+        '''
+        Polls every `interval` seconds from a watcher thread, started on the
+        first request of each process: threads do not survive a fork, so
+        every worker of a preloaded app needs its own.
+        '''
+        self.interval = interval
+        server.before_request(self._start)
+
+    def _start(self):
+        if not self.interval or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._run, name='data-watcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self.poll():
+                    self.last_error = None
+            except Exception as e:
+                self.last_error = '{}: {}'.format(type(e).__name__, e)
+                traceback.print_exc()
+
+    def info(self):
+        current = self.current
+        return {
+            'version': current.version,
+            'loaded': current.loaded,
+            'reloads': self.reloads,
+            'interval': self.interval,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# Seconds each Lazy value took to build, by name
+build_times = {}
+
+
+class Lazy:
+    '''
+    A module-level figure (or any JSON-able value) built on first use.
+
+    Plotly's JSON encoder calls to_plotly_json(), so a Lazy can be passed
+    straight to a component prop such as dcc.Graph(figure=...) and is only built
+    when the layout is first served. Build times are recorded in build_times.
+    '''
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.built = False
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self.built:
+            with self._lock:
+                if not self.built:
+                    started = time.perf_counter()
+                    self._value = self.build()
+                    build_times[self.name] = time.perf_counter() - started
+                    self.built = True
+        return self._value
+
+    def to_plotly_json(self):
+        value = self.get()
+        if hasattr(value, 'to_plotly_json'):
+            return value.to_plotly_json()
+        return value
+
+
+class Live:
+    '''
+    A layout value looked up again every time the layout is serialized, e.g.
+    a figure of whatever data version is current.
+    '''
+
+    def __init__(self, get):
+        self.get = get
+
+    def to_plotly_json(self):
+        value = self.get()
+        if hasattr(value, 'to_plotly_json'):
+            return value.to_plotly_json()
+        return value
+
+
+class FigureBank:
+    '''
+    Figures for a callback with a small, finite input space.
+
+    Every figure is built once, serialized to JSON and kept ready to send, so a
+    callback hit is a dict lookup instead of a plotly build. Figures are built
+    on first use; warm() builds all of them up front.
+    '''
+
+    def __init__(self, build, keys):
+        self.build = build
+        self.keys = list(keys)
+        self._json = {}
+        self._payload = {}
+        self._lock = threading.Lock()
+
+    def json(self, key):
+        text = self._json.get(key)
+        if text is None:
+            text = to_json_plotly(self.build(key))
+            with self._lock:
+                text = self._json.setdefault(key, text)
+        return text
+
+    def __getitem__(self, key):
+        payload = self._payload.get(key)
+        if payload is None:
+            payload = loads(self.json(key))
+            with self._lock:
+                payload = self._payload.setdefault(key, payload)
+        return payload
+
+    def __len__(self):
+        return len(self._json)
+
+    def warm(self):
+        for key in self.keys:
+            self[key]
+        return self
+
+    def clear(self):
+        with self._lock:
+            self._json.clear()
+            self._payload.clear()
+
+
+class FigureCache:
+    '''
+    Bounded LRU cache of serialized figures keyed on callback inputs.
+
+    Meant for callbacks whose input space is too large to prebuild. Entries are
+    kept as JSON text rather than go.Figure objects; the least recently used
+    entry is evicted once maxsize is reached.
+    '''
+
+    def __init__(self, build, maxsize=128):
+        self.build = build
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._json = OrderedDict()
+        self._lock = threading.Lock()
+
+    def json(self, *key):
+        with self._lock:
+            text = self._json.get(key)
+            if text is not None:
+                self._json.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+        text = to_json_plotly(self.build(*key))
+        if self.maxsize > 0:
+            with self._lock:
+                self._json[key] = text
+                self._json.move_to_end(key)
+                while len(self._json) > self.maxsize:
+                    self._json.popitem(last=False)
+                    self.evictions += 1
+        return text
+
+    def get(self, *key):
+        return loads(self.json(*key))
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._json),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._json.clear()
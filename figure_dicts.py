@@ -0,0 +1,120 @@
+'''
+Figures as plain dicts, for the figures built per request.
+
+Building through plotly objects runs a property validator for every attribute
+set, and update_layout merges the same margin/legend/color dicts into every
+figure. Here the layout of each kind of chart is built once through plotly
+(LayoutTemplate), so it is exactly what plotly would make of it, template
+included, and every figure of that kind reuses it. Traces are plain dicts with
+their keys in the order plotly writes them (sorted, type last), so a figure
+serializes to the same JSON as the plotly objects it replaces.
+
+Figures share their layout dicts: treat them as read-only. compact_figure()
+copies before it changes anything; update_layout() copies what it changes.
+'''
+
+import functools
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+
+def _plain(value):
+    # What plotly's validators would keep: arrays for pandas data, dicts sorted
+    if isinstance(value, (pd.Series, pd.Index)):
+        return value.to_numpy()
+    if isinstance(value, dict):
+        return {key: _plain(value[key]) for key in sorted(value) if value[key] is not None}
+    return value
+
+
+def trace(kind, **props):
+    # A trace of type kind; nested attributes are given whole, marker=dict(size=...)
+    trace = _plain(props)
+    trace['type'] = kind
+    return trace
+
+
+def update_layout(figure, changes):
+    '''
+    figure with its layout changed like fig.update_layout(), but with
+    changes as {(key, ..., key): value}. Only the dicts along a path are
+    copied.
+    '''
+    layout = dict(figure['layout'])
+    for path, value in changes.items():
+        node = layout
+        for key in path[:-1]:
+            node[key] = node = dict(node.get(key, {}))
+        node[path[-1]] = value
+    return dict(figure, layout=layout)
+
+
+class LayoutTemplate:
+
+    def __init__(self, build):
+        '''
+        build() returns a go.Figure with the layout of this kind of chart; it
+        is called once, on first use. Usable as a decorator.
+        '''
+        self.build = build
+        functools.update_wrapper(self, build)
+
+    @functools.cached_property
+    def layout(self):
+        return self.build().to_plotly_json()['layout']
+
+    def figure(self, data, changes=None):
+        figure = {'data': data, 'layout': self.layout}
+        return update_layout(figure, changes) if changes else figure
+
+
+def scatter_groups(df, x, y, size, color, hover_name, label=None, color_discrete_map=None, size_max=20,
+                   render_mode='svg'):
+    '''
+    The traces of px.scatter(df, x, y, size=size, color=color,
+    hover_name=hover_name, color_discrete_map=..., size_max=...,
+    render_mode=...) for a discrete color, a column of df or an array of
+    labels named `label`: one trace per label, in order of first appearance,
+    colored from color_discrete_map or else the template's colorway.
+    '''
+    labels = np.asarray(df[color] if isinstance(color, str) else color, dtype=object)
+    label = label or color
+    # Rows grouped by label without sorting the labels, like px's groupby(sort=False)
+    codes, values = pd.factorize(labels)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+    colors = dict(color_discrete_map or {})
+    colorway = pio.templates[pio.templates.default].layout.colorway
+    for value in values:
+        if value not in colors:
+            colors[value] = colorway[len(colors) % len(colorway)]
+    sizeref = df[size].max() / size_max ** 2
+    xs, ys, sizes, hovertext = (np.asarray(df[column]) for column in (x, y, size, hover_name))
+    # One hover line per column name, as px keeps them: x == y shows once
+    hover = {x: '%{x}', y: '%{y}', size: '%{marker.size}'}
+    hover_tail = ''.join('<br>{}={}'.format(name, ref) for name, ref in hover.items()) + '<extra></extra>'
+    hover_head = '<b>%{hovertext}</b><br><br>' + label + '='
+    kind = 'scattergl' if render_mode == 'webgl' else 'scatter'
+    traces = []
+    for i, value in enumerate(values):
+        rows = order[bounds[i]:bounds[i + 1]]
+        name = str(value)
+        traces.append(trace(
+            kind,
+            hovertemplate=hover_head + name + hover_tail,
+            hovertext=hovertext[rows],
+            legendgroup=name,
+            marker=dict(color=colors[value], size=sizes[rows], sizemode='area', sizeref=sizeref, symbol='circle'),
+            mode='markers',
+            name=name,
+            # Scattergl has no orientation
+            orientation='v' if kind == 'scatter' else None,
+            showlegend=True,
+            x=xs[rows],
+            xaxis='x',
+            y=ys[rows],
+            yaxis='y',
+        ))
+    return traces
@@ -0,0 +1,50 @@
+# Production serving: gunicorn -c gunicorn.conf.py
+#
+# The app is imported once in the master (preload_app) so the data frames and
+# prebuilt figures are shared copy-on-write by every forked worker.
+# kill -HUP <master> restarts workers gracefully with the reloaded config;
+# since the app is preloaded, new code needs kill -USR2 <master> (start a new
+# master) followed by kill -QUIT on the old one. Changed CSVs need neither:
+# every worker polls them and swaps the new version in (datasets.py).
+
+import gc
+import multiprocessing
+import os
+
+wsgi_app = 'app:server'
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 8080))
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers now and then so a leaking worker cannot grow forever
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+
+def on_starting(server):
+    # Move everything built at import into the permanent generation so the
+    # garbage collector does not touch (and copy) those pages in the workers
+    gc.freeze()
+    # Worker metrics of an earlier master would be added to this one's
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def worker_exit(server, worker):
+    # The exiting worker's counts, including those not flushed yet, go to
+    # METRICS_DIR/retired.json and its own file is removed (metrics.py)
+    if os.environ.get('METRICS_DIR'):
+        import app
+        app.callback_metrics.retire()
@@ -0,0 +1,200 @@
+'''
+HTTP caching for Dash callback responses.
+
+The callbacks are pure functions of their request (outputs, inputs and state)
+and of the CSV data loaded at startup. CallbackETags tags every
+_dash-update-component response with an ETag over the data version, the
+output and the input and state values of the request, so requests that differ
+only in changedPropIds or JSON formatting share it. It answers a matching If-None-Match with 304 before the callback
+runs, and sets Cache-Control so a reverse proxy in front of the app can keep
+and revalidate responses. Changing `version` invalidates every tag. Background
+callbacks answer with the state of a job rather than the outputs, so they are
+never tagged.
+
+CachedLayout serves /_dash-layout, the page layout with its embedded figures,
+from bytes serialized once per data version and kept gzip- and, with the
+Brotli package, brotli-compressed: a page load is then a copy of the
+encoding the browser accepts, or a 304 for its ETag.
+
+immutable_assets() marks content-hashed asset files as cacheable for good.
+'''
+
+import gzip
+import hashlib
+import json
+import re
+import threading
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Asset names that carry a hash of their content, e.g. vintage_map-640.ac3edd9a6f.jpg
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{10}\.\w+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def _values(dependencies):
+    # Pattern-matching callbacks send a list per wildcard input
+    return [_values(d) if isinstance(d, list) else d.get('value') for d in dependencies]
+
+
+class CallbackETags:
+
+    def __init__(self, app, version, max_age=0):
+        '''
+        app: the Dash app. max_age: seconds a cache may reuse a response
+        without revalidating; with 0 it must revalidate every time, so a
+        new data version takes effect at once.
+        '''
+        self.version = version
+        self.max_age = max_age
+        self.callback_map = app.callback_map
+        self.path = app.config.routes_pathname_prefix + '_dash-update-component'
+        self.tagged = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        app.server.before_request(self._before)
+        app.server.after_request(self._after)
+
+    def etag(self, body):
+        # body: the parsed request
+        canonical = [
+            self.version,
+            body.get('output'),
+            [_values(body.get('inputs', [])), _values(body.get('state', []))],
+        ]
+        return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:32]
+
+    def background(self, body):
+        return bool(self.callback_map.get(body.get('output'), {}).get('long'))
+
+    def _cache_control(self, response):
+        response.cache_control.public = True
+        if self.max_age:
+            response.cache_control.max_age = self.max_age
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    def _before(self):
+        request = flask.request
+        if request.method != 'POST' or request.path != self.path:
+            return None
+        # Cached, so Dash does not parse the body again
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or self.background(body):
+            return None
+        etag = self.etag(body)
+        flask.g.callback_etag = etag
+        if request.if_none_match.contains(etag):
+            with self._lock:
+                self.not_modified += 1
+            response = flask.Response(status=304)
+            response.set_etag(etag)
+            return self._cache_control(response)
+        return None
+
+    def _after(self, response):
+        etag = flask.g.pop('callback_etag', None)
+        # Only full callback responses; 204 is PreventUpdate, errors are not kept
+        if etag is None or response.status_code != 200:
+            return response
+        with self._lock:
+            self.tagged += 1
+        response.set_etag(etag)
+        return self._cache_control(response)
+
+    def info(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'tagged': self.tagged,
+                'not_modified': self.not_modified,
+            }
+
+
+class CachedLayout:
+
+    def __init__(self, app, version, level=9):
+        '''
+        app: the Dash app. The layout is serialized again once `version`
+        changes, so set it whenever a value the layout shows does.
+        '''
+        self.app = app
+        self.version = version
+        self.level = level
+        self.path = app.config.routes_pathname_prefix + '_dash-layout'
+        self.not_modified = 0
+        self._entry = None
+        self._lock = threading.Lock()
+        app.server.before_request(self._before)
+
+    def entry(self):
+        version = self.version
+        entry = self._entry
+        if entry is None or entry['version'] != version:
+            # One build per version, however many requests are waiting for it
+            with self._lock:
+                entry = self._entry
+                if entry is None or entry['version'] != version:
+                    entry = self._entry = self._build(version)
+        return entry
+
+    def _build(self, version):
+        # Exactly what Dash would send
+        body = self.app.serve_layout().get_data()
+        encodings = {'identity': body, 'gzip': gzip.compress(body, self.level, mtime=0)}
+        if brotli is not None:
+            encodings['br'] = brotli.compress(body, quality=11)
+        return {'version': version, 'etag': hashlib.sha256(body).hexdigest()[:32], 'encodings': encodings}
+
+    def _before(self):
+        request = flask.request
+        if request.method not in ('GET', 'HEAD') or request.path != self.path:
+            return None
+        entry = self.entry()
+        encoding = next((name for name in ('br', 'gzip')
+                         if name in entry['encodings'] and request.accept_encodings.quality(name) > 0), 'identity')
+        # Every encoding is a representation of its own
+        etag = entry['etag'] if encoding == 'identity' else '{}-{}'.format(entry['etag'], encoding)
+        if request.if_none_match.contains(etag):
+            with self._lock:
+                self.not_modified += 1
+            response = flask.Response(status=304)
+        else:
+            response = flask.Response(entry['encodings'][encoding], mimetype='application/json')
+            if encoding != 'identity':
+                response.content_encoding = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.no_cache = True
+        return response
+
+    def info(self):
+        entry = self._entry
+        return {
+            'version': self.version,
+            'bytes': {name: len(body) for name, body in entry['encodings'].items()} if entry else {},
+            'not_modified': self.not_modified,
+        }
+
+
+def immutable_assets(app, folder):
+    '''
+    Serves the fingerprinted files in assets/<folder>/ with a one year
+    immutable Cache-Control. Their names change whenever their content does.
+    '''
+    prefix = '{}{}/{}/'.format(
+        app.config.routes_pathname_prefix, app.config.assets_url_path.strip('/'), folder.strip('/'))
+
+    def cache_forever(response):
+        path = flask.request.path
+        if path.startswith(prefix) and FINGERPRINTED.search(path) and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    app.server.after_request(cache_forever)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Build-time pipeline for the background images.
+
+Every original in images/ is resized to a few widths and encoded as AVIF, WebP
+and JPEG into assets/img/. Each file name carries a hash of its content, so a
+changed image gets a new name and the app can serve assets/img/ as immutable.
+The generated assets/images.css defines one custom property per image,
+--bg-<name>. It holds an image-set() of the three formats, or a plain JPEG
+where image-set() with type() is not supported. Media queries switch it to a
+wider variant on wider screens. style.css uses the properties instead of urls.
+
+    python images.py
+
+Needs Pillow; AVIF variants need a Pillow built with AVIF (11.2+) and are
+skipped otherwise. The outputs are committed, so the app itself does not.
+'''
+
+import hashlib
+import io
+import os
+import sys
+from textwrap import indent
+
+SOURCE_DIR = 'images'
+OUTPUT_DIR = os.path.join('assets', 'img')
+STYLESHEET = os.path.join('assets', 'images.css')
+
+# Viewport widths the variants are made for; an image is never upscaled
+WIDTHS = [640, 1280, 1920, 2560]
+
+# extension, MIME type, Pillow format, save options; in order of preference
+FORMATS = [
+    ('avif', 'image/avif', 'AVIF', {'quality': 50, 'speed': 4}),
+    ('webp', 'image/webp', 'WEBP', {'quality': 75, 'method': 6}),
+    ('jpg', 'image/jpeg', 'JPEG', {'quality': 78, 'optimize': True, 'progressive': True}),
+]
+
+
+def encode(image, fmt, options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def variants(path, widths=WIDTHS, formats=FORMATS):
+    '''
+    {width: [(file name, MIME type, bytes), ...]} for one source image, best
+    format first.
+    '''
+    from PIL import Image, features
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with Image.open(path) as source:
+        source = source.convert('RGB')
+    sizes = sorted({min(width, source.width) for width in widths})
+    result = {}
+    for width in sizes:
+        height = round(source.height * width / source.width)
+        image = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+        files = []
+        for ext, mime, fmt, options in formats:
+            if ext == 'avif' and not features.check('avif'):
+                continue
+            data = encode(image, fmt, options)
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            files.append(('{}-{}.{}.{}'.format(stem, width, digest, ext), mime, data))
+        result[width] = files
+    return result
+
+
+def variant_for(images, width):
+    # The narrowest variant at least `width` wide, else the widest there is
+    fitting = [w for w in images if w >= width]
+    return images[min(fitting)] if fitting else images[max(images)]
+
+
+def image_set(files):
+    return 'image-set({})'.format(', '.join(
+        "url('img/{}') type('{}')".format(name, mime) for name, mime, _ in files))
+
+
+def stylesheet(images, widths=WIDTHS):
+    '''
+    CSS for {name: variants(...)}. Base rules target the narrowest screens; each
+    wider breakpoint only redefines the images whose variant changes there.
+    '''
+    def tiers(value):
+        blocks = []
+        previous = {}
+        for i, width in enumerate(widths):
+            rules = []
+            for name, variants_ in images.items():
+                files = variant_for(variants_, width)
+                if previous.get(name) != files[0][0]:
+                    previous[name] = files[0][0]
+                    rules.append('    --bg-{}: {};'.format(name, value(files)))
+            if not rules:
+                continue
+            block = ':root {{\n{}\n}}'.format('\n'.join(rules))
+            if i:
+                block = '@media (min-width: {}px) {{\n{}\n}}'.format(widths[i - 1] + 1, indent(block, '    '))
+            blocks.append(block)
+        return '\n'.join(blocks)
+
+    fallback = tiers(lambda files: "url('img/{}')".format(files[-1][0]))
+    preferred = tiers(image_set)
+    probe = next(iter(images.values()))
+    probe = image_set(variant_for(probe, widths[0]))
+    return '/* Generated by images.py from images/, do not edit */\n{}\n@supports (background-image: {}) {{\n{}\n}}\n'.format(
+        fallback, probe, indent(preferred, '    '))
+
+
+def build(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, css_path=STYLESHEET):
+    images = {}
+    for entry in sorted(os.listdir(source_dir)):
+        if entry.lower().endswith(('.jpg', '.jpeg', '.png')):
+            name = os.path.splitext(entry)[0].replace('_', '-')
+            images[name] = variants(os.path.join(source_dir, entry))
+
+    os.makedirs(output_dir, exist_ok=True)
+    wanted = set()
+    for name, sizes in images.items():
+        for files in sizes.values():
+            for filename, _, data in files:
+                wanted.add(filename)
+                target = os.path.join(output_dir, filename)
+                if not os.path.exists(target):
+                    with open(target, 'wb') as f:
+                        f.write(data)
+    # Variants of earlier versions of the images
+    for entry in os.listdir(output_dir):
+        if entry not in wanted:
+            os.remove(os.path.join(output_dir, entry))
+    with open(css_path, 'w') as f:
+        f.write(stylesheet(images))
+    return images
+
+
+if __name__ == '__main__':
+    for name, sizes in build(*sys.argv[1:]).items():
+        for width, files in sizes.items():
+            print('{} {}w: {}'.format(name, width, ', '.join(
+                '{} {:.0f} KB'.format(filename.rsplit('.', 1)[1], len(data) / 1024) for filename, _, data in files)))
@@ -0,0 +1,132 @@
+'''
+Level of detail for scatter plots of many rows.
+
+Above LOD_THRESHOLD rows a scatter plot is drawn from bins instead of rows: the
+rows are put on a grid in plot space (log10 on log axes) and every non-empty
+cell becomes one marker at the population-weighted centroid of its rows,
+sized by their total population and colored by the label holding most of it.
+The payload then depends on the grid, not on the number of rows.
+
+GridIndex keeps the rows sorted by grid cell, so the rows inside a zoomed-in
+window are found from the cells the window overlaps rather than by a scan.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+LOD_THRESHOLD = int(os.environ.get('LOD_THRESHOLD', 5000))
+# Cells per axis: at most 64 x 64 markers in 2D, 16 x 16 x 16 in 3D
+LOD_BINS = int(os.environ.get('LOD_BINS', 64))
+LOD_BINS_3D = int(os.environ.get('LOD_BINS_3D', 16))
+
+
+def plot_space(columns, logs):
+    # (rows x axes) coordinates as plotted; NaN where a log axis cannot show the value
+    points = np.column_stack([np.asarray(c, dtype=float) for c in columns])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis, log in enumerate(logs):
+            if log:
+                points[:, axis] = np.log10(points[:, axis])
+    points[~np.isfinite(points)] = np.nan
+    return points
+
+
+def extent(points):
+    shown = points[~np.isnan(points).any(axis=1)]
+    if not len(shown):
+        return np.zeros(points.shape[1]), np.ones(points.shape[1])
+    return shown.min(axis=0), shown.max(axis=0)
+
+
+def cells(points, lo, hi, bins):
+    span = np.where(hi > lo, hi - lo, 1.0)
+    index = np.floor((points - lo) / span * bins).astype(np.intp).clip(0, bins - 1)
+    return np.ravel_multi_index(index.T, (bins,) * points.shape[1])
+
+
+def color_map(labels):
+    # The colors plotly express gives labels of the whole table, so a subset
+    # or its bins keep them
+    colorway = pio.templates[pio.templates.default].layout.colorway
+    return {label: colorway[i % len(colorway)] for i, label in enumerate(pd.unique(np.asarray(labels, dtype=object)))}
+
+
+def subset(df, rows):
+    # Rows of df, with categoricals (from the data cache) cut down to the
+    # categories still used: plotly express would otherwise ask for empty groups
+    df = df.iloc[rows]
+    return df.assign(**{name: df[name].cat.remove_unused_categories()
+                        for name, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)})
+
+
+def names(counts):
+    # Hover names of bins
+    return ['{:,} places'.format(count) for count in counts]
+
+
+class GridIndex:
+
+    def __init__(self, points, bins=LOD_BINS):
+        '''
+        points: (rows x axes) plot space coordinates, NaN for rows not shown.
+        '''
+        self.points = points
+        self.bins = bins
+        self.lo, self.hi = extent(points)
+        shown = np.flatnonzero(~np.isnan(points).any(axis=1))
+        ids = cells(points[shown], self.lo, self.hi, bins)
+        order = np.argsort(ids, kind='stable')
+        self.rows = shown[order]
+        self.cells = ids[order]
+
+    def query(self, lo, hi):
+        # Rows inside the window [lo, hi] (plot space, per axis)
+        lo = np.maximum(lo, self.lo)
+        hi = np.minimum(hi, self.hi)
+        if (lo > hi).any():
+            return self.rows[:0]
+        first = cells(lo[None], self.lo, self.hi, self.bins)[0]
+        last = cells(hi[None], self.lo, self.hi, self.bins)[0]
+        ranges = [np.arange(a, b + 1) for a, b in zip(np.unravel_index(first, (self.bins,) * len(lo)),
+                                                     np.unravel_index(last, (self.bins,) * len(lo)))]
+        wanted = np.ravel_multi_index([r.ravel() for r in np.meshgrid(*ranges, indexing='ij')], (self.bins,) * len(lo))
+        starts = np.searchsorted(self.cells, wanted, 'left')
+        lengths = np.searchsorted(self.cells, wanted, 'right') - starts
+        # The rows of every overlapped cell, concatenated without a Python loop
+        total = lengths.sum()
+        positions = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        rows = self.rows[positions]
+        # Cells on the window's edge stick out of it
+        points = self.points[rows]
+        inside = ((points >= lo) & (points <= hi)).all(axis=1)
+        return np.sort(rows[inside])
+
+
+def aggregate(points, weights, labels, lo, hi, bins):
+    '''
+    One row per non-empty cell: the weighted centroid per axis (columns 0, 1,
+    ...), 'count' rows, their total 'weight' and the 'label' weighing most.
+    '''
+    shown = ~np.isnan(points).any(axis=1)
+    points = points[shown]
+    weights = np.nan_to_num(np.asarray(weights, dtype=float)[shown])
+    frame = pd.DataFrame({'cell': cells(points, lo, hi, bins), 'weight': weights,
+                          'label': np.asarray(labels, dtype=object)[shown], 'count': 1})
+    axes = range(points.shape[1])
+    for axis in axes:
+        frame[axis] = points[:, axis]
+        frame['w{}'.format(axis)] = points[:, axis] * weights
+    sums = frame.drop(columns='label').groupby('cell').sum()
+    weighted = sums['weight'].to_numpy() > 0
+    binned = pd.DataFrame({'count': sums['count'], 'weight': sums['weight']})
+    for axis in axes:
+        # Cells without any weight fall back to the plain mean
+        binned[axis] = np.where(weighted, sums['w{}'.format(axis)] / np.where(weighted, sums['weight'], 1),
+                                sums[axis] / sums['count'])
+    heaviest = frame.groupby(['cell', 'label'], sort=False)['weight'].sum()
+    heaviest = heaviest.sort_values(ascending=False, kind='stable').reset_index().drop_duplicates('cell')
+    binned['label'] = heaviest.set_index('cell')['label']
+    return binned.reset_index(drop=True)
@@ -0,0 +1,325 @@
+'''
+Per-callback metrics in the Prometheus text format, served on /metrics.
+
+For every server-side callback, by function and output component:
+
+- dash_callback_requests_total, by status: ok, prevented (PreventUpdate) or
+  error,
+- dash_callback_build_seconds, the callback function itself (figure building
+  or cache lookups),
+- dash_callback_serialize_seconds, the rest of Dash's callback handling,
+  mostly serializing the response,
+- dash_callback_response_bytes,
+- dash_callback_input_total, how often each input value was sent; every
+  value of a multi-select counts. Past MAX_VALUES distinct values per input
+  the rest count as "other", so users cannot blow up the series.
+
+And for the figures payload.py samples (PAYLOAD_SAMPLE), by figure:
+
+- dash_figure_sampled_total, figures measured,
+- dash_figure_bytes_total, their JSON bytes by stage: raw (as built) or
+  compact (as sent).
+
+Observations are a bisect and a few additions under a lock. Callbacks are
+timed by wrapping the function given to app.callback (timed()) and the
+handler Dash registers for it (instrument()); nothing is parsed again.
+
+Every process counts on its own. With METRICS_DIR set (several gunicorn
+workers) each one also writes its counts to METRICS_DIR/<pid>-<start>.json
+every few seconds, and /metrics adds up the files of all workers. A worker
+that exits adds its final counts to METRICS_DIR/retired.json and removes its
+own file (retire(), from gunicorn's worker_exit hook), so the directory does
+not grow with recycled workers and counters never go backwards. Files are
+named by start time as well as pid, so a reused pid never overwrites the
+counts of an earlier worker.
+'''
+
+import bisect
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+import flask
+from dash.exceptions import PreventUpdate
+
+TIME_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+BYTE_BUCKETS = (1e3, 3e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+MAX_VALUES = 50
+RETIRED = 'retired.json'
+
+FAMILIES = {
+    'dash_callback_requests_total': ('counter', 'Callback requests', None),
+    'dash_callback_build_seconds': ('histogram', 'Time in the callback function', TIME_BUCKETS),
+    'dash_callback_serialize_seconds': ('histogram', 'Time in Dash around the callback, mostly serializing the response', TIME_BUCKETS),
+    'dash_callback_response_bytes': ('histogram', 'Size of the JSON response in bytes', BYTE_BUCKETS),
+    'dash_callback_input_total': ('counter', 'Input values sent to callbacks', None),
+    'dash_figure_sampled_total': ('counter', 'Figures whose compaction was measured', None),
+    'dash_figure_bytes_total': ('counter', 'JSON bytes of the measured figures before and after compaction', None),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs)
+
+
+def _values(value):
+    # Label values of one input: every element of a multi-select, nothing for dicts
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if not isinstance(v, (dict, list))]
+    if isinstance(value, dict):
+        return []
+    return [str(value)]
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _add(series, rows):
+    # series ({(family, labels): value}) plus the rows of a snapshot
+    for family, labels, value in rows:
+        key = (family, tuple(map(tuple, labels)))
+        if isinstance(value, list):
+            current = series.get(key, [0] * len(value))
+            series[key] = [a + b for a, b in zip(current, value)]
+        else:
+            series[key] = series.get(key, 0) + value
+    return series
+
+
+class CallbackMetrics:
+
+    def __init__(self, server, directory=None, flush_interval=5):
+        # (family, labels) -> count, or [bucket counts..., sum, count] for histograms
+        self.series = {}
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._flusher_pid = None
+        self._file = None
+        self._retired = False
+        # A preloaded gunicorn master counts the figures it built at import;
+        # every worker would otherwise report them again
+        os.register_at_fork(after_in_child=self._forked)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            server.before_request(self._start)
+        server.add_url_rule('/metrics', 'metrics', self.serve)
+
+    def _forked(self):
+        self._lock = threading.Lock()
+        self.series = {}
+        self._seen = {}
+
+    def count(self, family, labels, amount=1):
+        key = (family, labels)
+        with self._lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def observe(self, family, labels, value):
+        buckets = FAMILIES[family][2]
+        key = (family, labels)
+        with self._lock:
+            entry = self.series.get(key)
+            if entry is None:
+                entry = self.series[key] = [0] * (len(buckets) + 3)
+            # One slot per bucket plus +Inf, then sum and count
+            entry[bisect.bisect_left(buckets, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def figure_bytes(self, name, before, after):
+        # A payload.listeners entry
+        labels = (('figure', name),)
+        self.count('dash_figure_sampled_total', labels)
+        self.count('dash_figure_bytes_total', labels + (('stage', 'raw'),), before)
+        self.count('dash_figure_bytes_total', labels + (('stage', 'compact'),), after)
+
+    def timed(self, fn):
+        '''
+        Wraps a callback function before it is given to app.callback, so
+        instrument() can tell building from serializing.
+        '''
+        local = self._local
+
+        def callback(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                local.build = time.perf_counter() - started
+
+        callback.__name__ = fn.__name__
+        callback.__qualname__ = fn.__qualname__
+        callback.__wrapped__ = fn
+        return callback
+
+    def instrument(self, app):
+        # Wraps the handler of every server-side callback registered so far
+        for entry in app.callback_map.values():
+            # Clientside callbacks have no handler
+            handler = entry.get('callback')
+            if handler is None or hasattr(handler, 'metrics_labels'):
+                continue
+            fn = handler.__wrapped__
+            name = getattr(fn, '__wrapped__', fn).__name__
+            output = entry['output']
+            output = output[0] if isinstance(output, (list, tuple)) else output
+            labels = (('callback', name), ('output', output.component_id))
+            inputs = [(i['id'], i['property']) for i in entry['inputs']]
+            entry['callback'] = self._handler(handler, labels, inputs)
+
+    def _handler(self, handler, labels, inputs):
+        local = self._local
+
+        def handle(*args, **kwargs):
+            self._inputs(labels, inputs, args)
+            local.build = None
+            started = time.perf_counter()
+            try:
+                response = handler(*args, **kwargs)
+            except PreventUpdate:
+                self.count('dash_callback_requests_total', labels + (('status', 'prevented'),))
+                raise
+            except Exception:
+                self.count('dash_callback_requests_total', labels + (('status', 'error'),))
+                raise
+            total = time.perf_counter() - started
+            self.count('dash_callback_requests_total', labels + (('status', 'ok'),))
+            # Background callbacks build in a job process; only their requests are timed
+            if local.build is not None:
+                self.observe('dash_callback_build_seconds', labels, local.build)
+                self.observe('dash_callback_serialize_seconds', labels, max(total - local.build, 0))
+            # Dash returns the JSON body as a str; count its encoded bytes
+            body = response.encode() if isinstance(response, str) else response
+            self.observe('dash_callback_response_bytes', labels, len(body))
+            return response
+
+        handle.__wrapped__ = handler.__wrapped__
+        handle.metrics_labels = labels
+        return handle
+
+    def _inputs(self, labels, inputs, args):
+        with self._lock:
+            for (component, prop), value in zip(inputs, args):
+                key = labels + (('input', '{}.{}'.format(component, prop)),)
+                seen = self._seen.setdefault(key, set())
+                for value in _values(value):
+                    if value not in seen:
+                        if len(seen) >= MAX_VALUES:
+                            value = 'other'
+                        else:
+                            seen.add(value)
+                    series = ('dash_callback_input_total', key + (('value', value),))
+                    self.series[series] = self.series.get(series, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[family, [list(pair) for pair in labels], value if isinstance(value, (int, float)) else list(value)]
+                    for (family, labels), value in self.series.items()]
+
+    def filename(self):
+        # This process's file, named when it is first written
+        pid = os.getpid()
+        if self._file is None or self._file[0] != pid:
+            self._file = (pid, os.path.join(self.directory, '{}-{}.json'.format(pid, time.time_ns())))
+        return self._file[1]
+
+    def _locked(self, operation):
+        # Held shared while files are added up, exclusively while a worker retires
+        f = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(f, operation)
+        return f
+
+    def _dump(self, rows, path):
+        # Atomically, so a scrape never reads half a file
+        handle, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(rows, f)
+        os.replace(tmp, path)
+
+    def write(self):
+        with self._locked(fcntl.LOCK_SH):
+            # The flusher may still run once the counts are retired
+            if not self._retired:
+                self._dump(self.snapshot(), self.filename())
+
+    def retire(self):
+        '''
+        Moves the counts of this process into the retired file, for a worker
+        about to exit.
+        '''
+        if not self.directory:
+            return
+        with self._locked(fcntl.LOCK_EX):
+            self._retired = True
+            path = os.path.join(self.directory, RETIRED)
+            rows = _add(_add({}, _read(path)), self.snapshot())
+            self._dump([[family, labels, value] for (family, labels), value in rows.items()], path)
+            if os.path.exists(self.filename()):
+                os.remove(self.filename())
+
+    def merged(self):
+        if not self.directory:
+            return self.snapshot()
+        self.write()
+        series = {}
+        with self._locked(fcntl.LOCK_SH):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    series = _add(series, _read(os.path.join(self.directory, name)))
+        return [[family, labels, value] for (family, labels), value in series.items()]
+
+    def render(self):
+        by_family = {}
+        for family, labels, value in self.merged():
+            by_family.setdefault(family, []).append((tuple(map(tuple, labels)), value))
+        lines = []
+        for family, (kind, help_text, buckets) in FAMILIES.items():
+            lines.append('# HELP {} {}'.format(family, help_text))
+            lines.append('# TYPE {} {}'.format(family, kind))
+            for labels, value in sorted(by_family.get(family, ())):
+                if kind == 'counter':
+                    lines.append('{}{{{}}} {}'.format(family, _labels(labels), value))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    lines.append('{}_bucket{{{}}} {}'.format(family, _labels(labels + (('le', bound),)), cumulative))
+                lines.append('{}_sum{{{}}} {}'.format(family, _labels(labels), value[-2]))
+                lines.append('{}_count{{{}}} {}'.format(family, _labels(labels), value[-1]))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        return flask.Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def _start(self):
+        # One flusher thread per worker process, as for the data watcher
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.write()
+            except OSError:
+                pass
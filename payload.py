@@ -0,0 +1,196 @@
+'''
+Payload minimization for figure outputs.
+
+compact_figure() turns a figure into a plain dict that renders the same but
+serializes smaller:
+
+- floats are rounded to PRECISION significant digits (FIGURE_PRECISION,
+  default 6), so small values keep their digits and large ones lose the
+  noise,
+- the template keeps only the trace defaults of trace types actually used,
+- attributes that are identical on every trace of a type (the hovertemplate,
+  marker sizing, subplot ids, ...) move into the template's trace defaults
+  instead of being repeated per trace. px writes the trace name into each
+  hovertemplate ('Genus=Germanic'); that part becomes %{fullData.name} first
+  so the templates can be shared.
+
+Measuring the bytes saved serializes the figure twice more, so it is
+sampled: with PAYLOAD_SAMPLE=N the bytes before and after of one in every N
+figures of each source are recorded in `savings` and passed to `listeners`
+(app.py counts them on /metrics). Unset or 0, nothing is measured.
+'''
+
+import os
+import threading
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+PRECISION = int(os.environ.get('FIGURE_PRECISION', 6))
+
+# Per-trace identity, never moved into the template
+TRACE_KEYS = {'type', 'name', 'legendgroup', 'uid', 'ids', 'meta'}
+
+SAMPLE = int(os.environ.get('PAYLOAD_SAMPLE', 0))
+
+savings = {}
+# Called with (name, bytes before, bytes after) for every figure measured
+listeners = []
+_compacted = {}
+_lock = threading.Lock()
+
+
+def significant(values, precision=PRECISION):
+    # values (floats) rounded to `precision` significant digits, as floats
+    # that print short: an integer over or times an exact power of ten
+    values = np.asarray(values, dtype=float)
+    digits = np.zeros(values.shape)
+    scaled = np.isfinite(values) & (values != 0)
+    digits[scaled] = np.minimum(precision - 1 - np.floor(np.log10(np.abs(values[scaled]))), 300)
+    scale = 10.0 ** np.abs(digits)
+    return np.where(digits >= 0, np.rint(values * scale) / scale, np.rint(values / scale) * scale)
+
+
+def rounded(value, precision=PRECISION):
+    if isinstance(value, dict):
+        return {k: rounded(v, precision) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [rounded(v, precision) for v in value]
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            return significant(value, precision).tolist()
+        return rounded(value.tolist(), precision)
+    if isinstance(value, (float, np.floating)):
+        return float(significant(value, precision))
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _common(values):
+    # The part of a list of attribute values that is the same everywhere
+    first = values[0]
+    if isinstance(first, dict):
+        if not all(isinstance(v, dict) for v in values):
+            return None
+        shared = {}
+        for key in first:
+            if all(key in v for v in values):
+                part = _common([v[key] for v in values])
+                if part is not None:
+                    shared[key] = part
+        return shared or None
+    if isinstance(first, list):
+        # Data arrays are never applied from a template
+        return None
+    if all(v == first for v in values[1:]):
+        return first
+    return None
+
+
+def _remove(target, shared):
+    for key, part in shared.items():
+        if isinstance(part, dict) and isinstance(target.get(key), dict) and part != target[key]:
+            _remove(target[key], part)
+            if not target[key]:
+                del target[key]
+        else:
+            del target[key]
+
+
+def _merge(target, shared):
+    for key, part in shared.items():
+        if isinstance(part, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], part)
+        else:
+            target[key] = part
+
+
+def _share_name(trace):
+    name = trace.get('name')
+    template = trace.get('hovertemplate')
+    if isinstance(name, str) and isinstance(template, str):
+        named = '={}<br>'.format(name)
+        if template.count(named) == 1:
+            trace['hovertemplate'] = template.replace(named, '=%{fullData.name}<br>')
+
+
+def hoist_trace_defaults(figure):
+    layout = figure.setdefault('layout', {})
+    template = layout.setdefault('template', {})
+    defaults = template.get('data', {})
+    by_type = {}
+    for trace in figure.get('data', []):
+        by_type.setdefault(trace.get('type', 'scatter'), []).append(trace)
+
+    # Trace defaults for types the figure does not use are dead weight
+    defaults = {kind: value for kind, value in defaults.items() if kind in by_type}
+    for kind, traces in by_type.items():
+        if len(traces) < 2:
+            continue
+        for trace in traces:
+            _share_name(trace)
+        shared = _common([{k: v for k, v in t.items() if k not in TRACE_KEYS} for t in traces])
+        if not shared:
+            continue
+        for trace in traces:
+            _remove(trace, shared)
+        entries = defaults.setdefault(kind, [{}])
+        for entry in entries:
+            _merge(entry, shared)
+    if defaults:
+        template['data'] = defaults
+    else:
+        template.pop('data', None)
+    return figure
+
+
+def _sampled(name):
+    if not SAMPLE or name is None:
+        return False
+    with _lock:
+        count = _compacted[name] = _compacted.get(name, 0) + 1
+    return (count - 1) % SAMPLE == 0
+
+
+def _record(name, before, after):
+    with _lock:
+        entry = savings.setdefault(name, {'figures': 0, 'bytes_before': 0, 'bytes_after': 0})
+        entry['figures'] += 1
+        entry['bytes_before'] += before
+        entry['bytes_after'] += after
+    for listener in listeners:
+        listener(name, before, after)
+
+
+def compact_figure(fig, name=None, precision=PRECISION):
+    '''
+    Compact plain-dict version of fig (a go.Figure or figure dict). name
+    is the callback or figure the bytes saved are recorded under, when
+    this figure is sampled.
+    '''
+    plain = fig.to_plotly_json() if hasattr(fig, 'to_plotly_json') else fig
+    figure = hoist_trace_defaults(rounded(plain, precision))
+    if _sampled(name):
+        _record(name, len(to_json_plotly(fig)), len(to_json_plotly(figure)))
+    return figure
+
+
+def compact_trace(trace, precision=PRECISION):
+    # For traces sent on their own, e.g. appended through a Patch
+    return rounded(trace.to_plotly_json() if hasattr(trace, 'to_plotly_json') else trace, precision)
+
+
+def report():
+    with _lock:
+        return {
+            name: dict(entry, saved=entry['bytes_before'] - entry['bytes_after'])
+            for name, entry in savings.items()
+        }
+
+
+def compacted(build, name=None):
+    # Wraps a figure builder so that it returns the compact figure
+    def build_compact(*args):
+        return compact_figure(build(*args), name)
+    return build_compact
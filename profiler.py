@@ -0,0 +1,165 @@
+'''
+Sampled profiling of callback requests, for finding where a slow interaction
+spends its time (plotly validation, make_subplots, pandas indexing, JSON
+encoding...).
+
+With PROFILE_SAMPLE=N one in every N _dash-update-component requests of a
+process is profiled: a sampler thread records the request thread's Python
+stack every PROFILE_INTERVAL seconds (default 0.001; in practice at most once
+per interpreter switch interval, 5 ms, while the request holds the GIL), and
+the samples are written to PROFILE_DIR (default profiles/) as a speedscope
+file, open it on https://www.speedscope.app for a flame graph. Each file is
+named after the callback output and a digest of its inputs, and the profile
+carries the inputs themselves.
+
+Without PROFILE_SAMPLE nothing is registered, so requests run exactly as
+before. Background callbacks build in job processes; only their requests are
+profiled.
+'''
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import flask
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+# Longest description of the inputs kept in a profile
+MAX_INPUTS = 2000
+
+
+def _frame_key(code):
+    # Python 3.11+ names methods with their class
+    return getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno
+
+
+def _describe(body):
+    # (callback output, inputs as name=value lines) of an update request
+    output = body.get('output', '')
+    inputs = ['{}.{}={}'.format(i.get('id'), i.get('property'), json.dumps(i.get('value')))
+              for group in ('inputs', 'state') for i in _flat(body.get(group, []))]
+    return output, '\n'.join(inputs)
+
+
+def _flat(dependencies):
+    # Pattern-matching callbacks send a list per wildcard input
+    for dependency in dependencies:
+        if isinstance(dependency, list):
+            yield from dependency
+        else:
+            yield dependency
+
+
+class Sampler:
+
+    def __init__(self, ident, interval):
+        self.ident = ident
+        self.interval = interval
+        self.frames = {}
+        self.samples = []
+        self.weights = []
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        last = self.started
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                key = _frame_key(frame.f_code)
+                stack.append(self.frames.setdefault(key, len(self.frames)))
+                frame = frame.f_back
+            stack.reverse()
+            # A sample stands for the time since the previous one
+            self.samples.append(stack)
+            self.weights.append(now - last)
+            last = now
+
+    def speedscope(self, name, exporter='profiler.py'):
+        frames = [{'name': function, 'file': path, 'line': line}
+                  for (function, path, line), _ in sorted(self.frames.items(), key=lambda item: item[1])]
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': exporter,
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(self.weights),
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }
+
+
+class RequestProfiler:
+
+    def __init__(self, app, sample, directory='profiles', interval=0.001):
+        '''
+        Profiles one in every `sample` callback requests of this process.
+        '''
+        self.sample = max(1, sample)
+        self.directory = directory
+        self.interval = interval
+        self.path = app.config.routes_pathname_prefix + '_dash-update-component'
+        self._requests = itertools.count()
+        self._files = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+        app.server.before_request(self._before)
+        app.server.teardown_request(self._teardown)
+
+    def _before(self):
+        if flask.request.path != self.path or next(self._requests) % self.sample:
+            return
+        sampler = Sampler(threading.get_ident(), self.interval)
+        flask.g.profile_sampler = sampler
+        sampler.start()
+
+    def _teardown(self, error=None):
+        sampler = flask.g.pop('profile_sampler', None)
+        if sampler is None:
+            return
+        sampler.stop()
+        body = flask.request.get_json(silent=True) or {}
+        output, inputs = _describe(body)
+        name = '{} ({:.0f} ms)\n{}'.format(output, sampler.duration * 1000, inputs[:MAX_INPUTS])
+        # Written by a thread of its own, so the response is not held up
+        threading.Thread(target=self.write, args=(sampler, name, output, inputs),
+                         name='profile-write', daemon=True).start()
+
+    def filename(self, output, inputs):
+        # Repeats of the same request within a second still get files of their own
+        label = re.sub(r'[^\w.-]+', '_', output).strip('_.')[:80] or 'callback'
+        digest = hashlib.sha256(inputs.encode()).hexdigest()[:8]
+        return '{}-{}.{}-{}-{}.speedscope.json'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(self._files),
+                                                        label, digest)
+
+    def write(self, sampler, name, output, inputs):
+        profile = sampler.speedscope(name)
+        handle, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(profile, f)
+        os.replace(tmp, os.path.join(self.directory, self.filename(output, inputs)))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Builds gen_max.csv and fam_max.csv from per-country personality type shares.
+
+The input has one row per country, keyed like top_top.csv (CODE or Country),
+and one column per type holding that type's share of the country. A country
+counts towards every genus (family) listed in its top_top.csv Genus (Family)
+cell, e.g. "Berber, Semitic". Shares are summed per genus and each genus's 16
+types ranked by their sum: column <genus> lists the types most common first,
+column <genus>_T the matching sums. Genera come in order of first appearance
+in top_top.csv.
+
+    python rank_tables.py shares.csv [--countries top_top.csv] [--out-dir .]
+
+GroupTotals keeps the per-group sums. When only some countries change,
+update() adjusts the sums of the groups they belong to and re-ranks only
+those.
+
+    python rank_tables.py --check [--countries top_top.csv] [--rounds 20]
+
+checks update() against a full rebuild: random shares for the countries of
+top_top.csv, then rounds of new shares, moved group cells, new groups and new
+countries, each compared with GroupTotals built from scratch on the result.
+It exits non-zero on the first difference.
+
+The same kind of table, one row per country, region or city, also gives the
+MAX_*/MIN_* rank columns of top_top.csv:
+
+    python rank_tables.py --ranks shares.csv [--chunksize 100000]
+
+sorts every row with one argsort per chunk and writes the key and the 16 rank
+columns into the data cache (see data_cache.py). Only the keys and one chunk
+of shares are in memory at a time; the ranks are int8 codes spooled to disk.
+read_ranks() returns them as a DataFrame, and with_ranks() puts them in place
+of the rank columns of top_top.csv. The app does both when SHARES_FILE names
+such a table: it is loaded and watched like the CSVs, ranked on first load
+(or ahead of time with --ranks), and its ranks replace those of top_top.csv
+for the countries it lists.
+
+    python rank_tables.py --bench [--rows 20000]
+
+times that against sorting row by row in pandas.
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+from ranks import N_TYPES, RANK_COLUMNS
+
+TOTAL_DECIMALS = 4
+
+# Rank columns in the order top_top.csv has them
+CSV_RANK_COLUMNS = sorted(RANK_COLUMNS)
+
+# top_top.csv column the groups come from -> table written
+TABLES = {'Genus': 'gen_max.csv', 'Family': 'fam_max.csv'}
+
+
+def rank_order(values):
+    # Column positions of every row, largest value first; ties keep column order
+    return np.argsort(-np.asarray(values, dtype=float), axis=1, kind='stable')
+
+
+def rank_codes(values):
+    # int8 type positions in the MAX_0..7, MIN_7..0 order of RANK_COLUMNS
+    return rank_order(values).astype(np.int8)
+
+
+def rank_columns(shares):
+    # The MAX_*/MIN_* columns of a shares table that fits in memory
+    names = np.asarray(shares.columns, dtype=object)[rank_codes(shares.to_numpy())]
+    return pd.DataFrame(names, index=shares.index, columns=RANK_COLUMNS)[CSV_RANK_COLUMNS]
+
+
+def memberships(groups):
+    # One (country, group) pair per group listed in a country's cell
+    pairs = groups.dropna().str.split(',').explode().str.strip()
+    return pairs[pairs != '']
+
+
+class GroupTotals:
+
+    def __init__(self, shares, groups):
+        '''
+        shares: one row per country (the index) and one column per type;
+        groups: the group cell of every country, on the same index.
+        '''
+        self.types = list(shares.columns)
+        self.shares = shares.astype(float)
+        self.groups = groups.reindex(shares.index)
+        pairs = memberships(self.groups)
+        sums = self.shares.loc[pairs.index].groupby(pairs.to_numpy(), sort=False).sum()
+        self.labels = list(sums.index)
+        self.sums = sums.to_numpy()
+        self.order = rank_order(self.sums)
+        self.members = pairs.value_counts(sort=False).reindex(self.labels).to_numpy()
+        self._index = {label: i for i, label in enumerate(self.labels)}
+
+    def update(self, shares, groups=None):
+        '''
+        New shares, and optionally new group cells, for some countries, new
+        countries included. Groups seen for the first time go last. Returns
+        the labels that were re-ranked.
+        '''
+        shares = shares[self.types].astype(float)
+        keys = shares.index
+        known = keys.intersection(self.shares.index)
+        old_groups = self.groups.reindex(known)
+        new_groups = self.groups.reindex(keys)
+        if groups is not None:
+            new_groups = groups.reindex(keys).fillna(new_groups)
+        if new_groups.isna().any():
+            raise ValueError('No groups for {}'.format(list(keys[new_groups.isna()])))
+
+        # Take the old contribution of every country out and put the new one in
+        removed = memberships(old_groups)
+        added = memberships(new_groups)
+        delta = pd.concat([
+            -self.shares.loc[removed.index].set_axis(removed.to_numpy()),
+            shares.loc[added.index].set_axis(added.to_numpy()),
+        ]).groupby(level=0, sort=False).sum()
+
+        for label in delta.index:
+            if label not in self._index:
+                self._index[label] = len(self.labels)
+                self.labels.append(label)
+        grow = len(self.labels) - len(self.sums)
+        if grow:
+            self.sums = np.vstack([self.sums, np.zeros((grow, len(self.types)))])
+            self.order = np.vstack([self.order, np.zeros((grow, len(self.types)), dtype=self.order.dtype)])
+            self.members = np.concatenate([self.members, np.zeros(grow, dtype=self.members.dtype)])
+        rows = np.array([self._index[label] for label in delta.index], dtype=np.intp)
+        self.sums[rows] += delta.to_numpy()
+        self.order[rows] = rank_order(self.sums[rows])
+        counts = added.value_counts().sub(removed.value_counts(), fill_value=0)
+        self.members[[self._index[label] for label in counts.index]] += counts.to_numpy(dtype=self.members.dtype)
+
+        new = keys.difference(self.shares.index)
+        self.shares.loc[known] = shares.loc[known]
+        self.groups.loc[known] = new_groups.loc[known]
+        if len(new):
+            self.shares = pd.concat([self.shares, shares.loc[new]])
+            self.groups = pd.concat([self.groups, new_groups.loc[new]])
+        return list(delta.index)
+
+    def table(self, decimals=TOTAL_DECIMALS):
+        # The gen_max.csv layout: type names per label, then their sums per
+        # label. Groups left without countries are dropped.
+        rows = np.flatnonzero(self.members > 0)
+        labels = [self.labels[i] for i in rows]
+        order = self.order[rows]
+        names = pd.DataFrame(np.asarray(self.types, dtype=object)[order].T, columns=labels)
+        totals = np.take_along_axis(self.sums[rows], order, axis=1).round(decimals)
+        totals = pd.DataFrame(totals.T, columns=['{}_T'.format(label) for label in labels])
+        return pd.concat([names, totals], axis=1)
+
+
+def read_shares(path, countries):
+    shares = pd.read_csv(path)
+    key = next(column for column in ('CODE', 'Country') if column in shares.columns)
+    shares = shares.set_index(key)
+    shares = shares.select_dtypes('number')
+    if shares.shape[1] != N_TYPES:
+        raise ValueError('{}: expected {} type columns, found {}'.format(path, N_TYPES, list(shares.columns)))
+    unknown = shares.index.difference(countries[key])
+    if len(unknown):
+        raise ValueError('{}: not in the country table: {}'.format(path, list(unknown)))
+    # In country table order, so groups come in their order of first appearance
+    order = countries[key][countries[key].isin(shares.index)]
+    return shares.loc[order], countries.set_index(key).loc[order]
+
+
+def build(shares, countries):
+    # {file name: table}; countries is indexed like shares
+    return {name: GroupTotals(shares, countries[column]).table() for column, name in TABLES.items()}
+
+
+def split_shares(chunk, path):
+    key = next((column for column in ('CODE', 'Country') if column in chunk.columns), chunk.columns[0])
+    values = chunk.drop(columns=key).select_dtypes('number')
+    if values.shape[1] != N_TYPES:
+        raise ValueError('{}: expected {} type columns, found {}'.format(path, N_TYPES, list(values.columns)))
+    return key, chunk[key], values
+
+
+def ranks_name(path):
+    # Cache entries are named after the shares file, e.g. cities_ranks-<hash>
+    return os.path.splitext(os.path.basename(path))[0] + '_ranks'
+
+
+def derive_ranks(path, chunksize=100000, cache_dir=data_cache.CACHE_DIR):
+    '''
+    Ranks the shares CSV at path chunk by chunk into the data cache. Returns
+    the cache directory.
+    '''
+    target = data_cache.cache_path(ranks_name(path), cache_dir, data_cache.file_hash(path))
+    if os.path.isdir(target):
+        return target
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = []
+    rows = 0
+    with tempfile.TemporaryFile(dir=cache_dir) as spool:
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            key, labels, values = split_shares(chunk, path)
+            if rows == 0:
+                types = list(values.columns)
+            elif list(values.columns) != types:
+                raise ValueError('{}: type columns change after row {}'.format(path, rows))
+            spool.write(rank_codes(values.to_numpy()).tobytes())
+            keys.append(labels.to_numpy(dtype=object))
+            rows += len(chunk)
+        spool.flush()
+        codes = np.memmap(spool, dtype=np.int8, mode='r', shape=(rows, N_TYPES)) if rows else np.empty((0, N_TYPES), np.int8)
+        labels = pd.Categorical(np.concatenate(keys) if keys else [])
+        columns = [(key, labels.codes, labels.categories.tolist())]
+        # Strided columns of the spool are saved a buffer at a time
+        columns += [(name, codes[:, RANK_COLUMNS.index(name)], types) for name in CSV_RANK_COLUMNS]
+        data_cache.write_columns(columns, rows, target)
+    data_cache.remove_stale(ranks_name(path), target, cache_dir)
+    return target
+
+
+def read_ranks(path, chunksize=100000, cache_dir=data_cache.CACHE_DIR):
+    # Key and MAX_*/MIN_* columns of a shares CSV, ranked on first use
+    return data_cache.read_cache(derive_ranks(path, chunksize, cache_dir))
+
+
+def with_ranks(countries, ranks):
+    '''
+    countries (top_top.csv) with the MAX_*/MIN_* columns replaced by those
+    of ranks (read_ranks()) for every row ranks has, matched on ranks'
+    key column. Rows ranks does not have keep their columns.
+    '''
+    key = ranks.columns[0]
+    ranked = ranks.set_index(key)[CSV_RANK_COLUMNS]
+    keys = countries[key].to_numpy(dtype=object)
+    found = pd.Index(keys).isin(ranked.index)
+    rows = ranked.index.get_indexer(keys[found])
+    countries = countries.copy(deep=False)
+    for column in CSV_RANK_COLUMNS:
+        values = countries[column].to_numpy(dtype=object).copy()
+        values[found] = ranked[column].to_numpy(dtype=object)[rows]
+        countries[column] = values
+    return countries
+
+
+def bench_ranks(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    types = ['T{:02d}'.format(i) for i in range(N_TYPES)]
+    # Rounded shares, so there are ties to break
+    shares = pd.DataFrame(rng.dirichlet(np.ones(N_TYPES), rows).round(3), columns=types)
+
+    started = time.perf_counter()
+    rowwise = shares.apply(lambda row: row.sort_values(ascending=False, kind='stable').index.tolist(),
+                           axis=1, result_type='expand').set_axis(RANK_COLUMNS, axis=1)[CSV_RANK_COLUMNS]
+    rowwise_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectorized = rank_columns(shares)
+    vectorized_time = time.perf_counter() - started
+
+    if not (vectorized.to_numpy() == rowwise.to_numpy()).all():
+        raise AssertionError('vectorized ranks differ from pandas')
+    print('{} rows: pandas row by row {:.3f} s, argsort {:.4f} s ({:.0f}x)'.format(
+        rows, rowwise_time, vectorized_time, rowwise_time / vectorized_time))
+
+
+def check_update(countries, rounds, seed=0):
+    rng = np.random.default_rng(seed)
+    key = 'CODE'
+    types = ['T{:02d}'.format(i) for i in range(N_TYPES)]
+    # Unrounded shares: no ties, so the order cannot depend on summing order
+    shares = pd.DataFrame(rng.dirichlet(np.ones(N_TYPES), len(countries)), index=countries[key], columns=types)
+    held = max(len(countries) // 10, 1)
+    for column in TABLES:
+        cells = countries.set_index(key)[column]
+        pool = cells.dropna().unique()
+        totals = GroupTotals(shares.iloc[:-held], cells.iloc[:-held])
+        pending = list(shares.index[-held:])
+        for i in range(rounds):
+            known = totals.shares.index
+            changed = rng.choice(known, size=max(len(known) // 20, 1), replace=False)
+            new = [pending.pop() for _ in range(min(len(pending), 2))]
+            keys = pd.Index(list(changed) + new)
+            update = pd.DataFrame(rng.dirichlet(np.ones(N_TYPES), len(keys)), index=keys, columns=types)
+            groups = None
+            if i % 2 == 0:
+                # Half of the changed countries move to another cell or a new group
+                moved = changed[:len(changed) // 2 + 1]
+                groups = pd.Series(rng.choice(pool, size=len(moved)), index=moved, dtype=object)
+                groups.iloc[0] = '{}, Check {}'.format(groups.iloc[0], i)
+                groups = pd.concat([groups, cells.loc[new]])
+            elif new:
+                groups = cells.loc[new]
+            totals.update(update, groups)
+
+            expected = GroupTotals(totals.shares, totals.groups).table()
+            actual = totals.table()
+            if set(actual.columns) != set(expected.columns):
+                raise AssertionError('{} round {}: groups only after update() {}, only rebuilt {}'.format(
+                    column, i, sorted(actual.columns.difference(expected.columns)),
+                    sorted(expected.columns.difference(actual.columns))))
+            expected = expected[actual.columns]
+            names = [c for c in actual.columns if not c.endswith('_T')]
+            sums = [c for c in actual.columns if c.endswith('_T')]
+            if not (actual[names].to_numpy() == expected[names].to_numpy()).all():
+                raise AssertionError('{} round {}: update() ranks differ from a rebuild'.format(column, i))
+            if not np.allclose(actual[sums].to_numpy(dtype=float), expected[sums].to_numpy(dtype=float),
+                               rtol=0, atol=2 * 10.0 ** -TOTAL_DECIMALS):
+                raise AssertionError('{} round {}: update() sums differ from a rebuild'.format(column, i))
+        print('{}: {} rounds of update() match a rebuild ({} groups, {} countries)'.format(
+            column, rounds, len(names), len(totals.shares)))
+
+
+def write_csv(df, path):
+    # Written to a temporary file and renamed, so the app's data watcher
+    # never loads a half written table
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.csv')
+    with os.fdopen(handle, 'w', newline='') as f:
+        df.to_csv(f, index=False)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build gen_max.csv and fam_max.csv from per-country type shares.')
+    parser.add_argument('shares', nargs='?')
+    parser.add_argument('--countries', default='top_top.csv')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--ranks', action='store_true', help='derive the MAX_*/MIN_* columns into the data cache')
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows ranked at a time with --ranks')
+    parser.add_argument('--bench', action='store_true', help='time the rank derivation against pandas')
+    parser.add_argument('--rows', type=int, default=20000, help='rows of random shares for --bench')
+    parser.add_argument('--check', action='store_true', help='compare GroupTotals.update() with full rebuilds')
+    parser.add_argument('--rounds', type=int, default=20, help='rounds of updates for --check')
+    args = parser.parse_args()
+
+    if args.bench:
+        bench_ranks(args.rows)
+        return 0
+    if args.check:
+        check_update(pd.read_csv(args.countries), args.rounds)
+        return 0
+    if args.shares is None:
+        parser.error('the shares CSV is required')
+    if args.ranks:
+        started = time.perf_counter()
+        target = derive_ranks(args.shares, args.chunksize)
+        print('{}: ranked -> {} in {:.1f} s'.format(args.shares, target, time.perf_counter() - started))
+        return 0
+
+    shares, countries = read_shares(args.shares, pd.read_csv(args.countries))
+    for name, table in build(shares, countries).items():
+        path = os.path.join(args.out_dir, name)
+        write_csv(table, path)
+        print('{}: {} groups from {} countries'.format(path, table.shape[1] // 2, len(shares)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
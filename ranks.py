@@ -0,0 +1,76 @@
+'''
+Integer-coded personality rank matrices.
+
+A RankMatrix holds, for every row (a country, a language genus, ...), the 16
+personality types ordered from most to least common, as int8 codes against a
+fixed type table. It also holds the inverse (type -> rank), so lookups such as
+"what rank is ENTJ in Serbia" or "every country where INTP is in the top 3"
+are NumPy indexing instead of scans over string columns.
+'''
+
+import numpy as np
+import pandas as pd
+
+N_TYPES = 16
+
+# Rank r is stored in the CSVs as MAX_r for the 8 most common types and
+# MIN_(15-r) for the 8 least common ones
+RANK_COLUMNS = ['MAX_{}'.format(r) for r in range(8)] + ['MIN_{}'.format(7 - r) for r in range(8)]
+
+
+def rank_column(rank):
+    return RANK_COLUMNS[rank]
+
+
+class RankMatrix:
+
+    def __init__(self, labels, table, types):
+        '''
+        labels: one label per row; table: (rows x 16) type names, most common
+        first; types: the type table the codes refer to.
+        '''
+        self.labels = np.asarray(labels, dtype=object)
+        self.types = list(types)
+        self.type_names = np.asarray(self.types, dtype=object)
+        table = np.asarray(table, dtype=object)
+        codes = pd.Categorical(table.ravel(), categories=self.types).codes
+        if (codes < 0).any():
+            unknown = sorted(set(table.ravel()) - set(self.types), key=str)
+            raise ValueError('Unknown personality types: {}'.format(unknown))
+        self.ranks = codes.astype(np.int8).reshape(table.shape)
+        self.positions = np.empty_like(self.ranks)
+        rows = np.arange(len(self.ranks))[:, None]
+        self.positions[rows, self.ranks] = np.arange(table.shape[1], dtype=np.int8)
+        self._index = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def from_rank_columns(cls, df, label_column, types):
+        # Row-per-label tables with MAX_*/MIN_* columns, like top_top.csv
+        table = np.column_stack([df[col].to_numpy(dtype=object) for col in RANK_COLUMNS])
+        return cls(df[label_column].to_numpy(dtype=object), table, types)
+
+    @classmethod
+    def from_label_columns(cls, df, labels, types):
+        # Column-per-label tables with one row per rank, like gen_max.csv
+        return cls(labels, df[list(labels)].to_numpy(dtype=object).T, types)
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def code(self, type_name):
+        return self.types.index(type_name)
+
+    def types_at(self, rank):
+        # Type name at the given rank, for every row
+        return self.type_names[self.ranks[:, rank]]
+
+    def order(self, label):
+        # Type names of one row, most common first
+        return self.type_names[self.ranks[self._index[label]]]
+
+    def rank_of(self, label, type_name):
+        return int(self.positions[self._index[label], self.code(type_name)])
+
+    def where(self, type_name, top=1):
+        # Labels of every row that has the type among its `top` most common
+        return self.labels[self.positions[:, self.code(type_name)] < top]
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Browser render benchmark for the bubble chart: SVG, WebGL and binned.
+
+    python render_bench.py [--points 1000 10000 100000] [--runs 3] [--out render_bench.html]
+
+Builds the bubble chart from top_top.csv resampled to each point count (with
+jittered metrics, like subnational data would be): every row with
+render_mode='svg' and with 'webgl', and binned as the app sends it above
+LOD_THRESHOLD rows ('lod'). It prints the build time and JSON size of each,
+and writes an HTML page that draws every figure --runs times with the
+plotly.js the app serves and reports the median time from newPlot to the next
+painted frame. Open the page in a browser; the results are shown in a
+table and logged to the console as JSON.
+'''
+
+import argparse
+import os
+import sys
+import time
+from functools import partial
+from types import SimpleNamespace
+
+os.environ['FIGURE_MODE'] = 'lazy'
+os.environ['DATA_RELOAD_INTERVAL'] = '0'
+
+import numpy as np
+import plotly
+from plotly.io.json import to_json_plotly
+
+import app
+from ranks import RankMatrix
+
+X, Y = 'GDP_per_capita_$', 'Life_expectancy'
+# A rank mode (types colored with colors_dict) and a Genus mode
+MODES = (0, 16)
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Bubble chart render benchmark</title>
+<style>
+body {{ font-family: sans-serif; }}
+td, th {{ padding: 2px 12px; text-align: right; }}
+#plot {{ width: 900px; height: 600px; }}
+</style>
+<script>{plotly_js}</script>
+</head>
+<body>
+<table id="results"><tr><th>points</th><th>mode</th><th>render</th><th>median ms</th><th>runs ms</th></tr></table>
+<div id="plot"></div>
+{figures}
+<script>
+(async function() {{
+    var plot = document.getElementById('plot');
+    var table = document.getElementById('results');
+    var results = [];
+    function painted() {{
+        return new Promise(function(resolve) {{
+            requestAnimationFrame(function() {{ setTimeout(resolve, 0); }});
+        }});
+    }}
+    for (var element of document.querySelectorAll('script[type="application/json"]')) {{
+        var times = [];
+        for (var run = 0; run < {runs}; run++) {{
+            var figure = JSON.parse(element.textContent);
+            Plotly.purge(plot);
+            await painted();
+            var started = performance.now();
+            await Plotly.newPlot(plot, figure.data, figure.layout);
+            await painted();
+            times.push(performance.now() - started);
+        }}
+        var sorted = times.slice().sort(function(a, b) {{ return a - b; }});
+        var result = Object.assign({{}}, element.dataset, {{
+            median_ms: Math.round(sorted[Math.floor(sorted.length / 2)]),
+            runs_ms: times.map(Math.round)
+        }});
+        results.push(result);
+        var row = table.insertRow();
+        [result.points, result.mode, result.render, result.median_ms, result.runs_ms.join(' ')].forEach(function(value) {{
+            row.insertCell().textContent = value;
+        }});
+    }}
+    Plotly.purge(plot);
+    window.renderBenchResults = results;
+    console.log(JSON.stringify(results));
+}})();
+</script>
+</body>
+</html>
+'''
+
+
+def resampled(data, points, seed=0):
+    # top_top.csv rows drawn with replacement, metrics jittered so the points spread
+    rng = np.random.default_rng(seed)
+    df = data.top_df.iloc[rng.integers(0, len(data.top_df), points)].reset_index(drop=True)
+    for column in (X, Y):
+        df[column] = df[column].to_numpy(dtype=float) * rng.lognormal(0, 0.1, points)
+    ranks = RankMatrix.from_rank_columns(df, 'Country', app.colors_dict)
+    data = SimpleNamespace(top_df=df, country_ranks=ranks)
+    data.bubble_grids = partial(app.bubble_grid, data)
+    return data
+
+
+def plotly_js():
+    path = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+    with open(path) as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a browser benchmark of the bubble chart in SVG and WebGL.')
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--out', default='render_bench.html')
+    args = parser.parse_args()
+
+    figures = []
+    print('{:>8} {:>5} {:>6} {:>9} {:>9}'.format('points', 'mode', 'render', 'build ms', 'JSON KB'))
+    for points in args.points:
+        data = resampled(app.versions.current, points)
+        for mode in MODES:
+            for render in ('svg', 'webgl', 'lod'):
+                started = time.perf_counter()
+                if render == 'lod':
+                    figure = app.bubble_lod_figure(data, X, Y, mode)
+                else:
+                    figure = app.bubble_scatter(data.top_df, X, Y, mode, app.bubble_labels(data, mode), render)
+                text = to_json_plotly(figure)
+                build = time.perf_counter() - started
+                print('{:>8} {:>5} {:>6} {:>9.0f} {:>9.0f}'.format(points, mode, render, build * 1000, len(text) / 1000))
+                figures.append('<script type="application/json" data-points="{}" data-mode="{}" data-render="{}">{}</script>'.format(
+                    points, mode, render, text.replace('</', '<\\/')))
+
+    with open(args.out, 'w') as f:
+        f.write(PAGE.format(plotly_js=plotly_js(), figures='\n'.join(figures), runs=args.runs))
+    print('open {} in a browser to time the rendering'.format(args.out))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+'''
+When to draw scatter plots with WebGL.
+
+SVG scatter traces get slow in the browser once a figure has a few thousand
+points; WebGL (Scattergl) stays fast, but every WebGL figure takes one of the
+few GL contexts a page gets, so small figures stay SVG. The choice is made per
+figure from its total point count rather than per trace as plotly express's
+render_mode='auto' does, so all traces of a figure are drawn the same way.
+
+WEBGL_THRESHOLD sets the point count above which a figure is WebGL (default
+1000, the cutoff of px's 'auto'; 0 for always). 3D scatter plots are always
+WebGL. Without a GPU, WebGL is software-rendered and a context alone costs
+a few hundred ms; SVG then stays faster up to several thousand points
+(render_bench.py), so raise it for such clients.
+'''
+
+import os
+
+WEBGL_THRESHOLD = int(os.environ.get('WEBGL_THRESHOLD', 1000))
+
+
+def render_mode(points, threshold=None):
+    # For px.scatter(render_mode=...)
+    threshold = WEBGL_THRESHOLD if threshold is None else threshold
+    return 'webgl' if points > threshold else 'svg'
+
+
+def scatter_type(mode):
+    # Trace type of a scatter plot drawn in mode
+    return 'scattergl' if mode == 'webgl' else 'scatter'
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+'''
+Static export of the report.
+
+    python static_export.py [out_dir] [--jobs N]
+
+The app is loaded with CALLBACK_MODE=static, where every callback runs in the
+browser, and is rendered into out_dir (default site/):
+
+- index.html, the layout and callback list, the Dash and component bundles
+  and the assets,
+- figures/bubble/<x>-<y>-<mode>.json, every bubble chart (x and y are
+  positions in the metric dropdown),
+- figures/genus.json and figures/family.json, the layout and one trace per
+  label of the genus and family charts.
+
+The slider map needs no files; its rank columns are part of the layout.
+assets/static_figures.js switches the figures. The result can be served by any
+static file server, e.g. python -m http.server -d site. Set
+DASH_REQUESTS_PATHNAME_PREFIX when it is not served from /.
+'''
+
+import argparse
+import multiprocessing
+import os
+import posixpath
+import re
+import shutil
+import sys
+import time
+
+os.environ['CALLBACK_MODE'] = 'static'
+os.environ['FIGURE_MODE'] = 'lazy'
+os.environ['DATA_RELOAD_INTERVAL'] = '0'
+
+from plotly.io.json import to_json_plotly
+
+import app
+import render_policy
+from payload import compact_figure, compact_trace
+
+# The renderer only accepts the layout and callback list served as JSON, which
+# a static server decides from the file extension
+FETCH_SHIM = '''<script>
+(function(fetch) {
+    window.fetch = function(input, init) {
+        if (typeof input === 'string') {
+            input = input.replace(/\\/_dash-(layout|dependencies)$/, '/_dash-$1.json');
+        }
+        return fetch.call(this, input, init);
+    };
+})(window.fetch);
+</script>
+'''
+
+# Version tag the component bundles insert into their async chunk names
+CHUNK_FINGERPRINT = re.compile(r'"(v\d+(?:_\d+)+m\d+)"')
+
+
+def write(root, path, data):
+    target = os.path.join(root, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+
+
+def get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError('{}: {}'.format(url, response.status))
+    return response.data
+
+
+def export_page(client, root):
+    prefix = app.app.config.requests_pathname_prefix
+    html = get(client, prefix).decode()
+    write(root, 'index.html', html.replace('<head>', '<head>\n' + FETCH_SHIM, 1))
+    write(root, '_dash-layout.json', get(client, prefix + '_dash-layout'))
+    write(root, '_dash-dependencies.json', get(client, prefix + '_dash-dependencies'))
+
+    # Bundles linked from the page, saved under their fingerprinted urls
+    linked = [url.split('?')[0] for url in re.findall(r'(?:src|href)="([^"]+)"', html)]
+    linked = [url for url in linked if url.startswith(prefix) and not url.startswith(prefix + 'assets/')]
+    fingerprints = {}
+    for url in linked:
+        data = get(client, url)
+        write(root, url[len(prefix):], data)
+        if url.endswith('.js'):
+            for tag in CHUNK_FINGERPRINT.findall(data.decode('utf-8', 'replace')):
+                fingerprints.setdefault(posixpath.dirname(url), set()).add(tag)
+
+    # Everything the bundles may load later (plotly.js, async chunks) by plain
+    # name, async chunks also by the fingerprinted name their bundle asks for
+    for namespace, paths in app.app.registered_paths.items():
+        for path in paths:
+            if path.endswith('.map'):
+                continue
+            url = '{}_dash-component-suites/{}/{}'.format(prefix, namespace, path)
+            data = get(client, url)
+            write(root, url[len(prefix):], data)
+            stem, ext = posixpath.splitext(url)
+            for tag in fingerprints.get(posixpath.dirname(url), ()):
+                name = posixpath.basename(stem).split('.', 1)
+                name.insert(1, tag)
+                write(root, posixpath.join(posixpath.dirname(url), '.'.join(name) + ext)[len(prefix):], data)
+
+    shutil.copytree(app.app.config.assets_folder, os.path.join(root, 'assets'), dirs_exist_ok=True)
+
+
+def bubble_chart(combo):
+    i, j, x, y, mode = combo
+    build = app.versions.current.bubble_chart_cache.build
+    return 'figures/bubble/{}-{}-{}.json'.format(i, j, mode), to_json_plotly(build(x, y, mode))
+
+
+def bubble_traces(df, ranks, labels):
+    figure = compact_figure(app.go_bubble_figure(df, ranks, labels))
+    # Any selection is drawn one way: the way all labels together would be
+    mode = render_policy.render_mode(len(df) * len(labels))
+    return {
+        'layout': figure['layout'],
+        'traces': {label: compact_trace(app.go_bubble_trace(df, ranks, label, mode)) for label in labels},
+    }
+
+
+def export_figures(root, jobs):
+    layout = app.app.layout
+    metrics = [option['value'] for option in layout['slct_chart_1'].options]
+    modes = sorted(layout['slct_chart_3'].marks)
+    combos = [(i, j, x, y, mode)
+              for i, x in enumerate(metrics) for j, y in enumerate(metrics) for mode in modes]
+    # Forked workers share the loaded app
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        for path, text in pool.imap_unordered(bubble_chart, combos, chunksize=8):
+            write(root, path, text)
+
+    data = app.versions.current
+    write(root, 'figures/genus.json', to_json_plotly(bubble_traces(data.gen_df, data.gen_ranks, data.gen_labels)))
+    write(root, 'figures/family.json', to_json_plotly(bubble_traces(data.fam_df, data.fam_ranks, data.fam_labels)))
+    return len(combos)
+
+
+def size(root):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(root) for name in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the report as static files.')
+    parser.add_argument('out_dir', nargs='?', default='site')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='processes building the bubble charts')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if os.path.isdir(args.out_dir) and os.listdir(args.out_dir):
+        # Only ever replace an earlier export
+        if not os.path.exists(os.path.join(args.out_dir, '_dash-layout.json')):
+            parser.error('{} is not empty and holds no export'.format(args.out_dir))
+        shutil.rmtree(args.out_dir)
+    export_page(app.server.test_client(), args.out_dir)
+    charts = export_figures(args.out_dir, args.jobs)
+    print('exported {} bubble charts to {} ({:.1f} MB) in {:.0f} s'.format(
+        charts, args.out_dir, size(args.out_dir) / 1e6, time.perf_counter() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())